@@ -1,58 +1,150 @@
 import queue
 import datetime
-from collections import deque
+import logging
+import os
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 MAX_ALERTS_IN_MEMORY = 100  # Mantener un historial de las últimas N alertas
 
-# Usaremos una deque con tamaño máximo para las alertas recientes para la API
-# y una queue.Queue para la comunicación entre threads si fuera necesario desacoplar más,
-# pero para obtener las "últimas N", una deque es más directa.
-# Por simplicidad y eficiencia para "últimas N", usaremos deque directamente.
-# Si el productor y consumidor fueran muy dispares en velocidad, queue.Queue sería mejor.
-
-# Esta deque almacenará las alertas para ser consultadas por la API.
-# Es thread-safe para appends y pops de ambos lados, pero el acceso concurrente
-# para obtener las "N últimas" debe ser manejado con cuidado si hay muchas escrituras.
-# Sin embargo, para este caso de uso (lectura de API no tan frecuente como detecciones),
-# debería ser suficiente.
-recent_alerts = deque(maxlen=MAX_ALERTS_IN_MEMORY)
+# Registro persistente de alertas en archivo, opcional: ruta en la variable de entorno IP_MONITOR_ALERT_LOG
+# (fuera del código fuente, p. ej. /var/log/ip_monitor/alertas.log). Sin ella solo se guardan en memoria.
+ALERT_LOG_FILE = os.environ.get("IP_MONITOR_ALERT_LOG") or None
+ALERT_LOG_MAX_BYTES = 10_000_000 # Tamaño máximo antes de rotar el archivo
+ALERT_LOG_BACKUP_COUNT = 5 # Archivos rotados que se conservan (alertas.log.1 ... .5)
+
+# Las alertas recientes se guardan en un buffer circular: una lista fija de
+# MAX_ALERTS_IN_MEMORY posiciones que se sobrescribe en orden. Así no hay nodos
+# nuevos por alerta (como en una deque) y las "últimas N" se leen por índice.
+# Una queue.Queue solo tendría sentido si hiciera falta desacoplar productor y consumidor.
+#
+# _alert_write_count cuenta las alertas escritas desde el inicio; la siguiente posición
+# a escribir es _alert_write_count % MAX_ALERTS_IN_MEMORY. El lock protege escritura y
+# lectura del buffer, que son O(1) y O(N) con N <= MAX_ALERTS_IN_MEMORY.
+_alert_buffer = [None] * MAX_ALERTS_IN_MEMORY
+_alert_write_count = 0
+_alert_lock = threading.Lock()
+
+# add_alert() solo encola el registro (QueueHandler); un único hilo (QueueListener) lo escribe en el
+# archivo rotativo, así las cámaras nunca esperan a la escritura en disco.
+_alert_logger = logging.getLogger("ip_monitor.alerts")
+_alert_logger.setLevel(logging.INFO)
+_alert_logger.propagate = False # No duplicar las alertas en el log general (uvicorn)
+_alert_log_queue = queue.Queue(-1)
+_alert_logger.addHandler(QueueHandler(_alert_log_queue))
+_alert_log_listener = None
+
+class _CachedSecondFormatter(logging.Formatter):
+    """Formatter que genera la parte de fecha y hora (hasta los segundos) una sola vez por segundo."""
+    _cached_second = None
+    _cached_prefix = ""
+
+    def formatTime(self, record, datefmt=None):
+        second = int(record.created)
+        if second != self._cached_second:
+            self._cached_prefix = time.strftime(self.default_time_format, self.converter(second))
+            self._cached_second = second
+        return self.default_msec_format % (self._cached_prefix, record.msecs)
+
+def start_alert_logging(log_file=ALERT_LOG_FILE):
+    """Inicia el hilo que escribe las alertas en 'log_file'. No hace nada si ya está iniciado o no hay archivo."""
+    global _alert_log_listener
+    if _alert_log_listener is not None or not log_file:
+        return
+    try:
+        file_handler = RotatingFileHandler(log_file, maxBytes=ALERT_LOG_MAX_BYTES,
+                                           backupCount=ALERT_LOG_BACKUP_COUNT, encoding="utf-8")
+    except OSError as e: # Un archivo no escribible no debe impedir que arranque el servidor
+        print(f"ERROR: No se pudo abrir el registro de alertas {log_file}: {e}. Alertas solo en memoria.")
+        return
+    file_handler.setFormatter(_CachedSecondFormatter("%(asctime)s - %(message)s"))
+    _alert_log_listener = QueueListener(_alert_log_queue, file_handler)
+    _alert_log_listener.start()
+    print(f"INFO: Registrando alertas en {log_file}")
+
+def stop_alert_logging():
+    """Escribe las alertas pendientes, detiene el hilo de registro y cierra el archivo."""
+    global _alert_log_listener
+    if _alert_log_listener is None:
+        return
+    _alert_log_listener.stop() # Procesa lo que quede en la cola antes de terminar
+    for handler in _alert_log_listener.handlers:
+        handler.close()
+    _alert_log_listener = None
 
 def add_alert(camera_id, camera_name, alert_details="Persona detectada"):
     """
     Añade una nueva alerta a la cola de alertas recientes.
     """
-    timestamp = datetime.datetime.now().isoformat()
+    global _alert_write_count
+    # Se guarda el epoch como float (mucho más barato que datetime.now().isoformat());
+    # el formato ISO se genera solo para las alertas que devuelve la API.
     alert_event = {
-        "timestamp": timestamp,
+        "timestamp": time.time(),
         "camera_id": camera_id,
         "camera_name": camera_name,
         "details": alert_details
     }
-    recent_alerts.append(alert_event)
+    with _alert_lock:
+        _alert_buffer[_alert_write_count % MAX_ALERTS_IN_MEMORY] = alert_event
+        _alert_write_count += 1
+
+    if _alert_log_listener is not None: # Sin hilo de registro la cola crecería sin consumirse
+        _alert_logger.warning("%s (%s) - %s", camera_name, camera_id, alert_details)
+
+def get_alert_count():
+    """Número de alertas actualmente almacenadas (como máximo MAX_ALERTS_IN_MEMORY)."""
+    return min(_alert_write_count, MAX_ALERTS_IN_MEMORY)
+
+def _newest_alerts(limit=None):
+    """Devuelve hasta 'limit' alertas, de la más reciente a la más antigua, leyendo solo esas posiciones."""
+    with _alert_lock:
+        written = _alert_write_count
+        count = min(written, MAX_ALERTS_IN_MEMORY)
+        if limit:
+            count = min(count, limit)
+        return [_alert_buffer[(written - 1 - i) % MAX_ALERTS_IN_MEMORY] for i in range(count)]
 
-    # También podríamos imprimir en consola o loggear desde aquí si se desea centralizar
-    # print(f"ALERTA REGISTRADA: {alert_event}")
+_iso_second_cache = (None, "") # (segundo epoch, "YYYY-MM-DDTHH:MM:SS" en hora local) del último timestamp formateado
+
+def _iso_timestamp(timestamp):
+    """
+    Igual que datetime.fromtimestamp(timestamp).isoformat(), pero la parte hasta los segundos se genera
+    una vez por segundo: las alertas de una misma ráfaga solo difieren en los microsegundos.
+    """
+    global _iso_second_cache
+    second = int(timestamp)
+    microsecond = round((timestamp - second) * 1_000_000)
+    if microsecond >= 1_000_000: # El redondeo puede pasar al segundo siguiente
+        second, microsecond = second + 1, microsecond - 1_000_000
+    cached_second, prefix = _iso_second_cache
+    if second != cached_second:
+        prefix = datetime.datetime.fromtimestamp(second).isoformat()
+        _iso_second_cache = (second, prefix)
+    return f"{prefix}.{microsecond:06d}" if microsecond else prefix
+
+def _format_alert(alert_event):
+    """Copia de la alerta con el timestamp en formato ISO 8601 (hora local), tal como la expone la API."""
+    formatted = dict(alert_event)
+    formatted["timestamp"] = _iso_timestamp(alert_event["timestamp"])
+    return formatted
 
 def get_recent_alerts(count=10):
     """
     Obtiene las 'count' alertas más recientes.
-    Devuelve una lista de alertas, la más reciente primero.
+    Devuelve una lista de alertas en orden cronológico (la más reciente al final).
     """
-    # Deque se llena por la derecha (append) y las más antiguas se caen por la izquierda.
-    # Para obtener las más recientes, tomamos los últimos N elementos.
-    # Convertir a lista para devolver una copia y evitar problemas de modificación concurrente.
-    return list(recent_alerts)[-count:]
+    if count <= 0:
+        return []
+    return [_format_alert(a) for a in _newest_alerts(count)][::-1]
 
 def get_all_alerts_sorted(limit=None):
     """
     Obtiene todas las alertas almacenadas, ordenadas de la más reciente a la más antigua.
     Se puede aplicar un límite.
     """
-    alerts_copy = list(recent_alerts)
-    alerts_copy.reverse() # Deque se itera de más antiguo a más nuevo, invertimos para más nuevo primero
-    if limit:
-        return alerts_copy[:limit]
-    return alerts_copy
+    return [_format_alert(a) for a in _newest_alerts(limit)]
 
 
 if __name__ == "__main__":
@@ -61,7 +153,6 @@ if __name__ == "__main__":
     add_alert("cam_01", "Entrada Principal", "Movimiento detectado")
     add_alert("cam_02", "Pasillo", "Persona cruzando")
 
-    import time
     time.sleep(1)
     add_alert("cam_01", "Entrada Principal", "Objeto sospechoso")
 
@@ -79,7 +170,7 @@ if __name__ == "__main__":
         if i < 5: # Imprimir las primeras para ver que se añaden
             print(f"Añadida alerta de cam_test_{i}")
 
-    print(f"\nTotal de alertas almacenadas: {len(recent_alerts)}") # Debería ser MAX_ALERTS_IN_MEMORY
+    print(f"\nTotal de alertas almacenadas: {get_alert_count()}") # Debería ser MAX_ALERTS_IN_MEMORY
 
     print("\nÚltimas 5 alertas después de llenar la cola:")
     last_5 = get_all_alerts_sorted(limit=5)
@@ -1,113 +1,291 @@
+import os
+# Opciones de captura de FFmpeg para baja latencia: RTSP sobre TCP y sin buffer de entrada,
+# para analizar siempre el frame más reciente. Se leen al abrir cada VideoCapture;
+# si el usuario ya definió la variable, se respeta su valor.
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "rtsp_transport;tcp|fflags;nobuffer|flags;low_delay")
+
 import cv2
+import asyncio
 import threading
 import time
 import datetime # Para timestamps en alertas
-from ip_monitor_server.detector import analyze_frame
+from concurrent.futures import ThreadPoolExecutor
+from ip_monitor_server.detector import (MODEL_TYPE, MOTION_GATE_ENABLED, DetectorService, analyze_frame, motion_gate,
+                                        motion_gate_open)
 from ip_monitor_server.alert_queue import add_alert
 
-class CameraHandler(threading.Thread):
-    def __init__(self, camera_info, alert_queue_module, processing_interval=0.5):
-        super().__init__()
+MAX_CONSECUTIVE_GRAB_FAILURES = 3 # Lecturas fallidas seguidas antes de dar la conexión por perdida
+FRAME_READ_TIMEOUT = 5 # Segundos máximos esperando un frame del hilo lector antes de contarlo como fallo
+# El detector pesado se ejecuta 1 de cada N frames analizados (por cámara: "detect_every_n_frames" en
+# config.json). En los intermedios solo se compara con el frame anterior: sin movimiento se repite el
+# último resultado, y si aparece movimiento en una escena sin personas se adelanta la detección.
+DETECT_EVERY_N_FRAMES = 5
+# Segundos mínimos entre dos alertas de la misma cámara (por cámara: "alert_cooldown" en config.json).
+# Con una persona frente a la cámara cada análisis daría una alerta casi idéntica.
+ALERT_COOLDOWN_SECONDS = 10.0
+
+# Decodificadores H.264 por hardware de GStreamer, en orden de preferencia:
+# NVDEC (NVIDIA), VA-API (Intel/AMD) y V4L2 (Raspberry Pi). Si ninguno abre, se usa FFmpeg por software.
+GSTREAMER_H264_DECODERS = ["nvh264dec", "vaapih264dec", "v4l2h264dec"]
+
+def _opencv_has_gstreamer():
+    """Indica si OpenCV fue compilado con soporte de GStreamer (WITH_GSTREAMER=ON)."""
+    for line in cv2.getBuildInformation().splitlines():
+        if line.strip().startswith("GStreamer:"):
+            return "YES" in line
+    return False
+
+GSTREAMER_AVAILABLE = _opencv_has_gstreamer()
+
+# Decodificación por hardware dentro del propio FFmpeg de OpenCV (>= 4.5.2): NVDEC, VA-API, QSV o D3D11
+# según la plataforma, con vuelta automática a software si no hay ninguno disponible.
+FFMPEG_HW_ACCELERATION_PARAMS = (
+    [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+    if hasattr(cv2, "VIDEO_ACCELERATION_ANY") else []
+)
+
+def _gstreamer_pipeline(url, decoder):
+    """Pipeline RTSP/H.264 que decodifica con 'decoder' y entrega solo el último frame BGR a OpenCV."""
+    return (f'rtspsrc location="{url}" latency=0 ! rtph264depay ! h264parse ! {decoder} ! '
+            'videoconvert ! video/x-raw,format=BGR ! appsink drop=true max-buffers=1 sync=false')
+
+class LatestFrameGrabber(threading.Thread):
+    """
+    Hilo lector de una cámara. En streams en vivo llama a grab() continuamente, así el stream nunca
+    acumula frames viejos mientras el detector trabaja, y decodifica con retrieve() solo el frame
+    siguiente a cada pedido de read(). En archivos solo lee cuando se le pide, para no recorrerlos
+    a toda velocidad. Es el único hilo que usa el VideoCapture, y lo libera al terminar.
+    """
+    def __init__(self, cap, camera_name, on_demand=False):
+        super().__init__(name=f"grabber-{camera_name}")
+        self.daemon = True
+        self.cap = cap
+        self.on_demand = on_demand
+        self.running = True
+        self.failed = False # El stream dejó de entregar frames (MAX_CONSECUTIVE_GRAB_FAILURES seguidos)
+        self._condition = threading.Condition()
+        self._requested = False
+        self._frame = None
+
+    def run(self):
+        consecutive_failures = 0
+        while self.running:
+            if self.on_demand:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._requested or not self.running)
+                if not self.running:
+                    break
+
+            if not self.cap.grab():
+                consecutive_failures += 1
+                if consecutive_failures >= MAX_CONSECUTIVE_GRAB_FAILURES:
+                    break
+                continue
+            consecutive_failures = 0
+
+            with self._condition:
+                requested = self._requested
+            if requested:
+                ret, frame = self.cap.retrieve()
+                with self._condition:
+                    if ret:
+                        self._requested = False
+                        self._frame = frame
+                        self._condition.notify_all()
+
+        with self._condition:
+            self.failed = self.running # Si nadie pidió detenerlo, es que el stream falló
+            self.running = False
+            self._condition.notify_all()
+        self.cap.release()
+
+    def read(self, timeout=FRAME_READ_TIMEOUT):
+        """Espera el próximo frame decodificado. Devuelve (ret, frame) como cap.read()."""
+        with self._condition:
+            self._frame = None
+            self._requested = True
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: self._frame is not None or not self.running, timeout)
+            frame, self._frame = self._frame, None
+            self._requested = False
+        return frame is not None, frame
+
+    def stop(self):
+        with self._condition:
+            self.running = False
+            self._condition.notify_all()
+
+def create_io_pool(num_cameras):
+    """Crea el pool compartido para las operaciones bloqueantes de cv2.VideoCapture (un hilo por cámara)."""
+    return ThreadPoolExecutor(max_workers=max(1, num_cameras), thread_name_prefix="camera_io")
+
+class CameraHandler:
+    def __init__(self, camera_info, alert_queue_module, detector_service, processing_interval=0.5, io_pool=None):
         self.camera_id = camera_info.get("id", "unknown_id")
         self.camera_name = camera_info.get("nombre", "Unknown Camera")
         self.camera_url = camera_info.get("url", None)
         self.alert_queue = alert_queue_module # Referencia al módulo alert_queue.py
 
         self.processing_interval = processing_interval # Segundos entre análisis de frames
+        # Con detección de movimiento como detector no hay nada más barato con qué intercalarlo, y con
+        # "motion_gated_yolo" el filtro de movimiento ya decide en cada frame si se ejecuta el detector
+        self.detect_every_n_frames = 1 if MODEL_TYPE == "simple_motion" or MOTION_GATE_ENABLED else \
+            max(1, int(camera_info.get("detect_every_n_frames", DETECT_EVERY_N_FRAMES)))
+        self.alert_cooldown = max(0.0, float(camera_info.get("alert_cooldown", ALERT_COOLDOWN_SECONDS)))
+        self.last_alert_time = None # time.monotonic() de la última alerta enviada
+        self.alert_message = f"Actividad detectada en {self.camera_name}" # Igual en todas las alertas
+        self.io_pool = io_pool # None usa el executor por defecto del event loop
+        # Servicio compartido que agrupa frames de todas las cámaras y es el único que toca el modelo
+        self.detector_service = detector_service
         self.running = False
         self.cap = None
-        self.daemon = True # El hilo terminará si el programa principal termina
+        self.grabber = None # LatestFrameGrabber dueño de self.cap mientras la conexión está activa
+        self.is_file_source = False # Archivos de video: entregan frames al instante, sin esperar al stream
 
         if not self.camera_url:
             print(f"ERROR [{self.camera_name}]: URL de cámara no proporcionada.")
-            # No se puede iniciar sin URL, pero el hilo podría no hacer nada o terminar.
+            # No se puede iniciar sin URL, pero la tarea podría no hacer nada o terminar.
             # Por ahora, se marcará como no corriendo.
             self.running = False
             return
 
-        print(f"INFO [{self.camera_name}]: Hilo de cámara inicializado para URL: {self.camera_url}")
+        print(f"INFO [{self.camera_name}]: Cámara inicializada para URL: {self.camera_url}")
+
+    def _open_capture(self):
+        """Abre el stream probando primero la decodificación por hardware (solo RTSP con GStreamer)."""
+        if GSTREAMER_AVAILABLE and self.camera_url.lower().startswith("rtsp://"):
+            for decoder in GSTREAMER_H264_DECODERS:
+                cap = cv2.VideoCapture(_gstreamer_pipeline(self.camera_url, decoder), cv2.CAP_GSTREAMER)
+                if cap.isOpened():
+                    print(f"INFO [{self.camera_name}]: Decodificando con GStreamer ({decoder}).")
+                    return cap
+                cap.release()
+            print(f"WARN [{self.camera_name}]: Sin decodificador H.264 por hardware en GStreamer. Usando FFmpeg.")
+        if not FFMPEG_HW_ACCELERATION_PARAMS: # OpenCV < 4.5.2 no tiene el constructor con parámetros
+            return cv2.VideoCapture(self.camera_url, cv2.CAP_FFMPEG)
+        cap = cv2.VideoCapture(self.camera_url, cv2.CAP_FFMPEG, FFMPEG_HW_ACCELERATION_PARAMS)
+        if cap.isOpened():
+            hw_acceleration = int(cap.get(cv2.CAP_PROP_HW_ACCELERATION))
+            if hw_acceleration != cv2.VIDEO_ACCELERATION_NONE:
+                print(f"INFO [{self.camera_name}]: Decodificando con FFmpeg por hardware (tipo {hw_acceleration}).")
+        return cap
 
     def _connect(self):
         print(f"INFO [{self.camera_name}]: Intentando conectar a {self.camera_url}...")
-        self.cap = cv2.VideoCapture(self.camera_url)
+        self.cap = self._open_capture()
         if not self.cap.isOpened():
             print(f"ERROR [{self.camera_name}]: No se pudo abrir el stream de video.")
             self.cap = None
             return False
+        # No acumular frames viejos en el buffer interno (por defecto hasta 4 frames)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # Solo las fuentes finitas (archivos) informan un número de frames
+        self.is_file_source = self.cap.get(cv2.CAP_PROP_FRAME_COUNT) > 0
+        self.grabber = LatestFrameGrabber(self.cap, self.camera_name, on_demand=self.is_file_source)
+        self.grabber.start()
         print(f"INFO [{self.camera_name}]: Conexión exitosa.")
         return True
 
-    def run(self):
+    def _release_capture(self):
+        """Detiene el hilo lector, que libera el VideoCapture al terminar."""
+        if self.grabber:
+            self.grabber.stop()
+        self.grabber = None
+        self.cap = None
+
+    async def _connect_async(self):
+        # Abrir un stream (RTSP/HTTP) bloquea varios segundos: se hace en el pool de IO
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_pool, self._connect)
+
+    async def run_async(self):
+        loop = asyncio.get_running_loop()
         self.running = True
 
         if not self.camera_url:
-            print(f"ERROR [{self.camera_name}]: No hay URL para procesar. Terminando hilo.")
+            print(f"ERROR [{self.camera_name}]: No hay URL para procesar. Terminando tarea.")
             self.running = False
             return
 
-        if not self._connect():
+        if not await self._connect_async():
             # Intentar reconectar después de un tiempo si la conexión inicial falla
             print(f"WARN [{self.camera_name}]: Conexión inicial fallida. Reintentando en 10 segundos...")
-            time.sleep(10)
-            if not self._connect(): # Segundo intento
-                print(f"ERROR [{self.camera_name}]: Conexión fallida después de reintento. Terminando hilo.")
+            await asyncio.sleep(10)
+            if not await self._connect_async(): # Segundo intento
+                print(f"ERROR [{self.camera_name}]: Conexión fallida después de reintento. Terminando tarea.")
                 self.running = False
                 return
 
         last_processed_time = time.time()
+        consecutive_failures = 0
+        frame_idx = 0
+        last_result = (False, []) # Último resultado del detector, reutilizado en los frames intermedios
 
         while self.running:
             if self.cap is None: # Si perdimos la conexión
                 print(f"WARN [{self.camera_name}]: Conexión perdida. Intentando reconectar en 10 segundos...")
-                time.sleep(10)
-                if not self._connect():
+                await asyncio.sleep(10)
+                if not await self._connect_async():
                     print(f"ERROR [{self.camera_name}]: Falla al reconectar. Esperando otros 30s antes de reintentar.")
-                    time.sleep(30) # Espera más larga antes del próximo ciclo de reconexión
+                    await asyncio.sleep(30) # Espera más larga antes del próximo ciclo de reconexión
                     continue # Vuelve al inicio del while self.running para reintentar conexión
                 else:
                     last_processed_time = time.time() # Resetear tiempo de procesamiento
+                    consecutive_failures = 0
+
+            # El hilo lector mantiene el stream al día: dormir en el event loop hasta el próximo análisis
+            sleep_for = last_processed_time + self.processing_interval - time.time()
+            if sleep_for > 0:
+                await asyncio.sleep(sleep_for)
 
-            ret, frame = self.cap.read()
+            ret, frame = await loop.run_in_executor(self.io_pool, self.grabber.read)
 
             if not ret:
+                consecutive_failures += 1
+                if not self.grabber.failed and consecutive_failures < MAX_CONSECUTIVE_GRAB_FAILURES:
+                    continue # Fallo puntual: reintentar la lectura sin reconectar
                 print(f"WARN [{self.camera_name}]: No se pudo leer el frame. Stream podría haber terminado o hay un problema.")
-                if self.cap:
-                    self.cap.release()
-                self.cap = None # Marcar para reconexión
+                self._release_capture() # Marcar para reconexión
                 continue # Ir al siguiente ciclo para intentar reconectar
-
+            consecutive_failures = 0
             current_time = time.time()
-            if (current_time - last_processed_time) >= self.processing_interval:
-                # Procesar frame
-                try:
-                    detection_made, details = analyze_frame(frame, self.camera_id)
-                    if detection_made:
-                        alert_message = f"Actividad detectada en {self.camera_name}"
-                        if details: # Si hay detalles (ej. bounding boxes)
-                            # Por ahora, solo un mensaje genérico. Se podrían añadir los detalles si es necesario.
-                            # alert_message += f" Detalles: {details}" # Esto podría ser muy verboso para la alerta simple
-                            pass
-
-                        self.alert_queue.add_alert(
-                            camera_id=self.camera_id,
-                            camera_name=self.camera_name,
-                            alert_details=alert_message
-                        )
-                        # print(f"DEBUG [{self.camera_name}]: Alerta enviada a la cola: {alert_message}")
-
-                except Exception as e:
-                    print(f"ERROR [{self.camera_name}]: Excepción durante analyze_frame: {e}")
-
-                last_processed_time = current_time
-
-            # Pequeña pausa para ceder el control, especialmente si el processing_interval es muy bajo
-            # o si la lectura de frames es más rápida que el intervalo.
-            # Esto evita un bucle muy ajustado si el intervalo es grande.
-            time.sleep(0.01)
-
-        if self.cap:
-            self.cap.release()
-        print(f"INFO [{self.camera_name}]: Hilo de cámara terminado.")
+
+            # Procesar frame
+            try:
+                run_detector = frame_idx % self.detect_every_n_frames == 0
+                if MOTION_GATE_ENABLED:
+                    # "motion_gated_yolo": solo se envían al detector los frames con movimiento reciente
+                    run_detector = await loop.run_in_executor(self.io_pool, motion_gate_open, frame, self.camera_id)
+                    if not run_detector:
+                        last_result = (False, [])
+                elif self.detect_every_n_frames > 1:
+                    # Se evalúa en todos los frames para que el frame de referencia sea siempre el anterior
+                    motion_detected = await loop.run_in_executor(self.io_pool, motion_gate, frame, self.camera_id)
+                    run_detector = run_detector or (motion_detected and not last_result[0])
+                frame_idx += 1
+
+                if run_detector:
+                    # submit() puede reducir el frame antes de enviarlo (ProcessDetectorPool): fuera del event loop
+                    future = await loop.run_in_executor(self.io_pool, self.detector_service.submit, frame, self.camera_id)
+                    last_result = await asyncio.wrap_future(future)
+                detection_made, details = last_result
+                now = time.monotonic()
+                if detection_made and (self.last_alert_time is None or now - self.last_alert_time >= self.alert_cooldown):
+                    self.last_alert_time = now
+                    # Solo un mensaje genérico: las cajas de 'details' serían muy verbosas para la alerta simple
+                    self.alert_queue.add_alert(
+                        camera_id=self.camera_id,
+                        camera_name=self.camera_name,
+                        alert_details=self.alert_message
+                    )
+
+            except Exception as e:
+                print(f"ERROR [{self.camera_name}]: Excepción durante analyze_frame: {e}")
+
+            last_processed_time = current_time
+
+        self._release_capture()
+        print(f"INFO [{self.camera_name}]: Tarea de cámara terminada.")
 
     def stop(self):
         print(f"INFO [{self.camera_name}]: Solicitud de detención recibida.")
@@ -145,25 +323,31 @@ if __name__ == '__main__':
     # se necesitaría modificar la prueba para alimentar frames manualmente.
     # Por ahora, esta prueba se centra en la conexión y el bucle.
 
-    handler = CameraHandler(test_cam_info, mock_queue_module, processing_interval=2)
+    detector_service = DetectorService()
+    detector_service.start()
+    handler = CameraHandler(test_cam_info, mock_queue_module, detector_service, processing_interval=2)
 
-    if not test_cam_info["url"]:
-        print("Prueba no puede continuar sin una URL de ejemplo funcional.")
-    else:
-        handler.start()
-        print("Hilo de prueba iniciado. Se ejecutará durante 15 segundos...")
+    async def run_test():
+        task = asyncio.create_task(handler.run_async())
+        print("Tarea de prueba iniciada. Se ejecutará durante 15 segundos...")
         print("Observar los logs para ver intentos de conexión y procesamiento.")
         print(f"Usando MODEL_TYPE='{analyze_frame.__globals__.get('MODEL_TYPE', 'No definido en detector')}' para detección.")
+        try:
+            await asyncio.sleep(15) # Dejar que la tarea se ejecute por un tiempo
+        finally:
+            print("Deteniendo tarea de prueba...")
+            handler.stop()
+            await asyncio.wait([task], timeout=5) # Esperar a que la tarea termine
+            print("Tarea de prueba detenida.")
+            detector_service.stop()
 
+    if not test_cam_info["url"]:
+        print("Prueba no puede continuar sin una URL de ejemplo funcional.")
+    else:
         try:
-            time.sleep(15) # Dejar que el hilo se ejecute por un tiempo
+            asyncio.run(run_test())
         except KeyboardInterrupt:
             print("Interrupción de teclado recibida.")
-        finally:
-            print("Deteniendo hilo de prueba...")
-            handler.stop()
-            handler.join(timeout=5) # Esperar a que el hilo termine
-            print("Hilo de prueba detenido.")
 
         print("\nAlertas capturadas en la cola simulada:")
         for alert_msg in mock_queue_module.get_all_alerts_sorted():
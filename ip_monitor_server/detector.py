@@ -1,26 +1,146 @@
 import cv2
-import time # Para posible logging de tiempo de detección
+import multiprocessing
+import numpy as np
+import os
+import queue
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future, ProcessPoolExecutor
 
 # --- Configuración del Modelo de Detección ---
 # MODEL_TYPE = "simple_motion"
 MODEL_TYPE = "cvlib_yolov4_tiny" # Opción ligera por defecto para CPU
 # MODEL_TYPE = "pytorch_yolov5" # Opción más pesada, requiere torch, ultralytics
+# MODEL_TYPE = "onnx_yolov5n" # YOLOv5n FP32 con ONNX Runtime (CPU), exportado con export_yolov5n_onnx()
+# MODEL_TYPE = "onnx_yolov5n_int8" # YOLOv5n cuantizado a INT8 con ONNX Runtime (CPU), ver quantize_model.py
+# MODEL_TYPE = "openvino_int8" # El mismo YOLOv5n INT8 convertido a IR y ejecutado con OpenVINO (CPU Intel)
+# MODEL_TYPE = "motion_gated_yolo" # Detección de movimiento como filtro: el YOLO solo corre si hubo movimiento reciente
+
+# --- Detector con filtro de movimiento ("motion_gated_yolo") ---
+# En escenas estáticas no se ejecuta ninguna inferencia: primero se mira si hubo movimiento y solo entonces
+# se llama al backend YOLO de MOTION_GATED_DETECTOR. Tras el último movimiento el detector sigue corriendo
+# MOTION_GATE_STICKY_SECONDS, para no perder a una persona que entró y se quedó quieta.
+MOTION_GATED_DETECTOR = "cvlib_yolov4_tiny" # Cualquier backend YOLO de los de arriba
+MOTION_GATE_STICKY_SECONDS = 2.0
+MOTION_GATE_ENABLED = MODEL_TYPE == "motion_gated_yolo"
+if MOTION_GATE_ENABLED:
+    MODEL_TYPE = MOTION_GATED_DETECTOR # A partir de aquí MODEL_TYPE es siempre el backend que se carga
+
+# --- Parámetros de YOLOv4-tiny (OpenCV DNN) ---
+# Por defecto se usan los mismos archivos que descarga cvlib, así una instalación
+# que ya ejecutó cvlib alguna vez no necesita volver a descargar el modelo.
+YOLO_DARKNET_DIR = os.path.join(os.path.expanduser("~"), ".cvlib", "object_detection", "yolo", "yolov3")
+YOLO_DARKNET_CFG = os.path.join(YOLO_DARKNET_DIR, "yolov4-tiny.cfg")
+YOLO_DARKNET_WEIGHTS = os.path.join(YOLO_DARKNET_DIR, "yolov4-tiny.weights")
+# Si faltan, se descargan la primera vez desde las mismas URLs que usaba cvlib
+YOLO_DARKNET_CFG_URL = "https://raw.githubusercontent.com/AlexeyAB/darknet/master/cfg/yolov4-tiny.cfg"
+YOLO_DARKNET_WEIGHTS_URL = "https://github.com/AlexeyAB/darknet/releases/download/darknet_yolo_v4_pre/yolov4-tiny.weights"
+YOLO_INPUT_SIZE = (416, 416)
+PERSON_CLASS_ID = 0 # Clase 'person' en COCO
+PERSON_CONFIDENCE_THRESHOLD = 0.4
+NMS_THRESHOLD = 0.3 # Mismo valor que usaba cvlib.detect_common_objects
+
+# Backends de OpenCV DNN en orden de preferencia: GPU (CUDA FP16), OpenVINO y CPU genérico.
+DNN_BACKEND_PREFERENCE = [
+    (cv2.dnn.DNN_BACKEND_CUDA, cv2.dnn.DNN_TARGET_CUDA_FP16),
+    (cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE, cv2.dnn.DNN_TARGET_CPU),
+    (cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_CPU),
+]
+
+# --- Parámetros de YOLOv5n FP32 / INT8 (ONNX Runtime) ---
+MODELS_DIR = os.path.join(os.path.dirname(__file__), "models")
+ONNX_FP32_MODEL_PATH = os.path.join(MODELS_DIR, "yolov5n.onnx") # Exportado con export_yolov5n_onnx()
+ONNX_INT8_MODEL_PATH = os.path.join(MODELS_DIR, "yolov5n_int8.onnx") # Generado por quantize_model.py
+OPENVINO_INT8_MODEL_PATH = os.path.join(MODELS_DIR, "yolov5n_int8.xml") # IR (+ .bin) generado por quantize_model.py
+ONNX_MODEL_PATHS = {
+    "onnx_yolov5n": ONNX_FP32_MODEL_PATH,
+    "onnx_yolov5n_int8": ONNX_INT8_MODEL_PATH,
+}
+YOLOV5_INPUT_SIZE = (640, 640)
+# Proveedores de ONNX Runtime en orden de preferencia (solo se usan los que estén instalados)
+ONNX_PROVIDER_PREFERENCE = ["OpenVINOExecutionProvider", "CPUExecutionProvider"]
+
+# --- Parámetros de YOLOv5n con TensorRT (MODEL_TYPE "pytorch_yolov5" en GPU) ---
+# Si TensorRT está instalado y hay CUDA, el modelo de PyTorch Hub se exporta una vez a ONNX y se
+# compila a un engine FP16 que se guarda en MODELS_DIR; las siguientes ejecuciones solo lo deserializan.
+PYTORCH_USE_TENSORRT = True
+TENSORRT_ENGINE_PATH = os.path.join(MODELS_DIR, "yolov5n_fp16.engine")
+TENSORRT_WORKSPACE_BYTES = 1 << 30 # Memoria temporal máxima que TensorRT puede usar al compilar
+# Capacidad CUDA mínima para FP16 en PyTorch (Volta, con Tensor Cores). En Pascal FP16 no es más rápido.
+PYTORCH_FP16_MIN_CAPABILITY = 7
+# torch.compile (PyTorch >= 2.0) y formato channels_last para el modelo de PyTorch Hub en GPU
+PYTORCH_COMPILE = True
+
+# --- Reducción de resolución antes de detectar ---
+# Los modelos YOLO reescalan internamente a su entrada, así que trabajar con el frame
+# completo (p. ej. 1080p) solo añade copias y conversiones de color más caras.
+# Estos modelos estiran el frame a su entrada sin conservar la proporción: se redimensiona
+# una sola vez directamente a ese tamaño (ancho, alto) y su propio resize pasa a ser una copia.
+DETECTION_INPUT_SIZE = {
+    "cvlib_yolov4_tiny": YOLO_INPUT_SIZE,
+    "onnx_yolov5n": YOLOV5_INPUT_SIZE,
+    "onnx_yolov5n_int8": YOLOV5_INPUT_SIZE,
+    "openvino_int8": YOLOV5_INPUT_SIZE,
+    # "pytorch_yolov5" se añade al cargar el engine de TensorRT, que también estira a YOLOV5_INPUT_SIZE
+}
+# Para el resto, lado mayor (en píxeles) al que se reduce cada frame conservando la proporción
+DETECTION_MAX_SIDE = {
+    "pytorch_yolov5": YOLOV5_INPUT_SIZE[0], # AutoShape hace letterbox: necesita la proporción original
+    "simple_motion": 320, # El coste de GaussianBlur es proporcional al número de píxeles
+}
+# --- Detección por lotes (DetectorService) ---
+DETECTION_BATCH_SIZE = 8 # Máximo de frames (de distintas cámaras) por inferencia
+DETECTION_BATCH_WAIT = 0.05 # Segundos que se espera a completar un lote antes de procesarlo
+# --- Detección en procesos (ProcessDetectorPool) ---
+# Con backends de CPU se puede analizar en procesos separados (un proceso por grupo de cámaras) en lugar
+# del hilo con lotes de DetectorService. OpenCV DNN y ONNX Runtime ya liberan el GIL y usan varios hilos,
+# así que los lotes suelen bastar; los procesos ayudan cuando el coste en Python por frame domina.
+DETECTION_USE_PROCESSES = False
+CPU_MODEL_TYPES = {"cvlib_yolov4_tiny", "onnx_yolov5n", "onnx_yolov5n_int8", "openvino_int8", "simple_motion"}
+
+MOTION_MIN_AREA = 700 # Área mínima (en píxeles del frame original) para considerar movimiento relevante
+MOTION_GATE_MAX_SIDE = 320 # Resolución de trabajo de motion_gate (entre ejecuciones del detector pesado)
+MOTION_GATE_LAST_MOTION = {} # camera_id -> time.monotonic() del último movimiento visto por el filtro
+FRAME_SCALES = {} # camera_id -> ((alto, ancho), (ancho, alto) de trabajo, (sx, sy)), calculado una vez por cámara y resolución
 
 # --- Inicialización de Modelos (solo se cargan si se usan) ---
 DETECTION_MODEL_INSTANCE = None
-PREVIOUS_FRAMES_FOR_MOTION = {} # Usado solo si MODEL_TYPE es "simple_motion"
+MODEL_LOADED = False # load_detection_model() ya se ejecutó en este proceso
+MODEL_LOAD_LOCK = threading.Lock()
+DETECTION_NUM_THREADS = None # Hilos de inferencia; None usa el valor por defecto de cada backend
+DNN_NET = None # Red YOLOv4-tiny de OpenCV DNN, cargada una sola vez con load_detection_model()
+DNN_OUTPUT_LAYERS = None
+DNN_LOCK = threading.Lock() # cv2.dnn.Net no es thread-safe y se comparte entre hilos de cámara
+ONNX_SESSION = None # Sesión de ONNX Runtime, creada una sola vez con load_detection_model()
+ONNX_INPUT_NAME = None
+OPENVINO_MODEL = None # CompiledModel de OpenVINO, compilado una sola vez con load_detection_model()
+# Lo siguiente lo comparten ONNX Runtime y OpenVINO (mismo modelo YOLOv5n, mismo preproceso)
+ONNX_DYNAMIC_BATCH = False # True si el modelo ONNX acepta lotes de tamaño variable
+ONNX_LOCK = threading.Lock() # Protege los buffers de entrada compartidos entre hilos de cámara
+# Buffers de entrada reutilizados en cada inferencia (se reservan solo si se usa ONNX Runtime u OpenVINO)
+ONNX_RESIZED_BUFFER = None
+ONNX_INPUT_BUFFER = None # (DETECTION_BATCH_SIZE, 3, H, W)
+PREVIOUS_FRAMES_FOR_MOTION = {} # Usado solo si MODEL_TYPE es "simple_motion"; buffer persistente por cámara
+MOTION_SCRATCH = {} # camera_id -> buffers intermedios (gray, blur, delta, thresh, mask) reutilizados en cada frame
+TENSORRT_AVAILABLE = False # Solo se usa con MODEL_TYPE "pytorch_yolov5"
+PYTORCH_FP16 = False # True si el modelo de PyTorch Hub se ejecuta en FP16 (GPU con Tensor Cores)
+NUMBA_AVAILABLE = False # Si numba está instalado, el movimiento se calcula con un único kernel fusionado
+MOTION_NUMBA_BUFFERS = {} # camera_id -> buffers del kernel de movimiento (solo con numba)
+MOTION_TILE_ROWS = 64 # Filas por bloque en el kernel de movimiento, para que cada bloque quepa en L2
+MOTION_THRESHOLD = 30 # Diferencia mínima de intensidad para considerar que un píxel cambió
+# Kernels de la cadena de OpenCV, construidos una sola vez en lugar de en cada frame
+# Con sepFilter2D da lo mismo que GaussianBlur((21, 21), 0) salvo redondeo: hasta 2 niveles de gris, muy por
+# debajo de MOTION_THRESHOLD
+MOTION_GAUSSIAN_KERNEL = cv2.getGaussianKernel(21, 0).astype(np.float32)
+# Una dilatación con un rectángulo 5x5 equivale exactamente a dos con el 3x3 por defecto, en una sola pasada
+MOTION_DILATE_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
+MOTION_OPENCL_PREVIOUS = {} # camera_id -> (tamaño, UMat del frame anterior), solo en el camino OpenCL
 
 # --- Importaciones condicionales y carga de modelos ---
 if MODEL_TYPE == "cvlib_yolov4_tiny":
-    try:
-        import cvlib
-        # No se carga el modelo aquí, cvlib.detect_common_objects lo maneja internamente
-        print("INFO: detector.py configurado para usar cvlib (YOLOv4-tiny).")
-    except ImportError:
-        print("ERROR: cvlib no está instalado. MODEL_TYPE='cvlib_yolov4_tiny' no funcionará.")
-        print("Por favor, instale cvlib, tensorflow y opencv-python, o cambie MODEL_TYPE.")
-        # Podríamos cambiar MODEL_TYPE a un fallback o dejar que falle al intentar usar cvlib.
-        # Por ahora, se notificará el error y fallará si se intenta usar.
+    # El modelo se carga con load_detection_model() en el proceso que lo usa
+    print("INFO: detector.py configurado para usar OpenCV DNN (YOLOv4-tiny).")
 
 elif MODEL_TYPE == "pytorch_yolov5":
     try:
@@ -30,22 +150,364 @@ elif MODEL_TYPE == "pytorch_yolov5":
     except ImportError:
         print("ERROR: PyTorch no está instalado. MODEL_TYPE='pytorch_yolov5' no funcionará.")
         print("Por favor, instale PyTorch y ultralytics, o cambie MODEL_TYPE.")
+    if PYTORCH_USE_TENSORRT:
+        try:
+            import tensorrt as trt
+            TENSORRT_AVAILABLE = True
+        except ImportError:
+            print("INFO: TensorRT no está instalado, YOLOv5 se ejecutará directamente en PyTorch.")
+
+elif MODEL_TYPE in ONNX_MODEL_PATHS:
+    try:
+        import onnxruntime as ort
+        # La sesión se crea con load_detection_model() en el proceso que la usa
+        print(f"INFO: detector.py configurado para usar ONNX Runtime ({os.path.basename(ONNX_MODEL_PATHS[MODEL_TYPE])}).")
+    except ImportError:
+        print(f"ERROR: onnxruntime no está instalado. MODEL_TYPE='{MODEL_TYPE}' no funcionará.")
+        print("Por favor, instale onnxruntime (u onnxruntime-openvino), o cambie MODEL_TYPE.")
+
+elif MODEL_TYPE == "openvino_int8":
+    try:
+        import openvino as ov
+        # El modelo se compila con load_detection_model() en el proceso que lo usa
+        print("INFO: detector.py configurado para usar OpenVINO (YOLOv5n INT8).")
+    except ImportError:
+        print("ERROR: openvino no está instalado. MODEL_TYPE='openvino_int8' no funcionará.")
+        print("Por favor, instale openvino, o cambie MODEL_TYPE.")
 
 elif MODEL_TYPE == "simple_motion":
     print("INFO: detector.py configurado para usar Detección de Movimiento Simple.")
+    try:
+        import numba
+        from numba import njit, prange
+        # Con la capa TBB (la preferida por defecto) el proceso no termina al salir si el kernel se ejecutó
+        # fuera del hilo principal (DetectorService, procesos de detección): preferir OpenMP y luego workqueue.
+        # NUMBA_THREADING_LAYER sigue teniendo prioridad si está definida.
+        numba.config.THREADING_LAYER_PRIORITY = ["omp", "workqueue", "tbb"]
+        NUMBA_AVAILABLE = True
+        print("INFO: numba disponible, se usará el kernel de movimiento fusionado.")
+    except ImportError:
+        print("INFO: numba no está instalado, se usará la cadena de funciones de OpenCV para el movimiento.")
 
 else:
     print(f"ADVERTENCIA: MODEL_TYPE '{MODEL_TYPE}' no reconocido. La detección no funcionará.")
 
 
+def _download_darknet_files():
+    """Descarga en YOLO_DARKNET_DIR los archivos de YOLOv4-tiny que falten, como hacía cvlib. Devuelve True si están todos."""
+    os.makedirs(YOLO_DARKNET_DIR, exist_ok=True)
+    for url, path in ((YOLO_DARKNET_CFG_URL, YOLO_DARKNET_CFG), (YOLO_DARKNET_WEIGHTS_URL, YOLO_DARKNET_WEIGHTS)):
+        if os.path.exists(path):
+            continue
+        print(f"INFO: Descargando {os.path.basename(path)} (solo la primera vez)...")
+        partial_path = path + ".part" # Una descarga interrumpida no deja un archivo incompleto con el nombre final
+        try:
+            urllib.request.urlretrieve(url, partial_path)
+            os.replace(partial_path, path)
+        except OSError as e:
+            print(f"ERROR: No se pudo descargar {url}: {e}")
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            return False
+    return True
+
+def _load_darknet_model():
+    """
+    Carga YOLOv4-tiny con cv2.dnn (descargándolo si hace falta) y elige el backend más rápido disponible.
+    Devuelve (net, nombres_capas_salida) o (None, None) si el modelo no pudo cargarse.
+    """
+    if not _download_darknet_files():
+        print(f"ERROR: Faltan los archivos de YOLOv4-tiny en {YOLO_DARKNET_DIR}.")
+        print("Descargue yolov4-tiny.cfg y yolov4-tiny.weights (repositorio de Darknet) en esa carpeta.")
+        return None, None
+    try:
+        net = cv2.dnn.readNetFromDarknet(YOLO_DARKNET_CFG, YOLO_DARKNET_WEIGHTS)
+    except cv2.error as e:
+        print(f"ERROR: Al cargar YOLOv4-tiny con OpenCV DNN: {e}")
+        return None, None
+
+    for backend, target in DNN_BACKEND_PREFERENCE:
+        if target in cv2.dnn.getAvailableTargets(backend):
+            net.setPreferableBackend(backend)
+            net.setPreferableTarget(target)
+            print(f"INFO: YOLOv4-tiny cargado en OpenCV DNN (backend={backend}, target={target}).")
+            break
+    return net, net.getUnconnectedOutLayersNames()
+
+def _nms_people_boxes(boxes_xywh, confidences):
+    """
+    Aplica NMS a cajas de personas (x, y, w, h en píxeles) y devuelve la lista de detalles
+    con el mismo formato que el resto de detectores: {"box": [xmin, ymin, xmax, ymax], "confidence": c}.
+    """
+    keep = cv2.dnn.NMSBoxes(boxes_xywh.tolist(), confidences.tolist(), PERSON_CONFIDENCE_THRESHOLD, NMS_THRESHOLD)
+    detected_people_boxes = []
+    for i in np.asarray(keep).flatten():
+        x, y, w, h = boxes_xywh[i]
+        detected_people_boxes.append({
+            "box": [int(round(x)), int(round(y)), int(round(x + w)), int(round(y + h))],
+            "confidence": float(confidences[i])
+        })
+    return detected_people_boxes
+
+def _load_onnx_session(model_path=ONNX_INT8_MODEL_PATH):
+    """
+    Crea la sesión de ONNX Runtime con el mejor proveedor disponible.
+    Devuelve (session, nombre_entrada) o (None, None) si no pudo crearse.
+    """
+    if not os.path.exists(model_path):
+        print(f"ERROR: No se encontró el modelo ONNX {model_path}.")
+        print("Genérelo con: python -m ip_monitor_server.quantize_model")
+        return None, None
+    try:
+        available = ort.get_available_providers()
+        providers = [p for p in ONNX_PROVIDER_PREFERENCE if p in available]
+        session_options = ort.SessionOptions()
+        # Un hilo por núcleo físico: los hilos extra de hyperthreading compiten por las mismas unidades SIMD
+        session_options.intra_op_num_threads = DETECTION_NUM_THREADS or max(1, (os.cpu_count() or 1) // 2)
+        session = ort.InferenceSession(model_path, sess_options=session_options, providers=providers)
+    except NameError: # onnxruntime no importado
+        print("ERROR: onnxruntime no está disponible (NameError). No se puede crear la sesión.")
+        return None, None
+    except Exception as e:
+        print(f"ERROR: Al crear la sesión de ONNX Runtime para {model_path}: {e}")
+        return None, None
+    print(f"INFO: Modelo {os.path.basename(model_path)} cargado en ONNX Runtime (proveedores: {session.get_providers()}).")
+    return session, session.get_inputs()[0].name
+
+def _load_openvino_model(model_path=OPENVINO_INT8_MODEL_PATH):
+    """Compila el modelo IR de OpenVINO para CPU. Devuelve el CompiledModel o None si no pudo cargarse."""
+    if not os.path.exists(model_path):
+        print(f"ERROR: No se encontró el modelo de OpenVINO {model_path}.")
+        print("Genérelo con: python -m ip_monitor_server.quantize_model")
+        return None
+    try:
+        config = {"PERFORMANCE_HINT": "LATENCY"} # Un lote por llamada, desde un único hilo
+        if DETECTION_NUM_THREADS:
+            config["INFERENCE_NUM_THREADS"] = DETECTION_NUM_THREADS
+        compiled_model = ov.compile_model(model_path, "CPU", config)
+    except NameError: # openvino no importado
+        print("ERROR: openvino no está disponible (NameError). No se puede compilar el modelo.")
+        return None
+    except Exception as e:
+        print(f"ERROR: Al compilar {model_path} con OpenVINO: {e}")
+        return None
+    print(f"INFO: Modelo {os.path.basename(model_path)} compilado con OpenVINO (CPU).")
+    return compiled_model
+
+def preprocess_yolov5(frame, resized_buffer, chw_buffer):
+    """
+    Escribe el frame en 'chw_buffer' (3, H, W) con el formato de entrada de YOLOv5 (RGB, float32 en 0..1)
+    reutilizando los buffers recibidos, sin reservar memoria nueva.
+    """
+    cv2.resize(frame, YOLOV5_INPUT_SIZE, dst=resized_buffer, interpolation=cv2.INTER_LINEAR)
+    cv2.cvtColor(resized_buffer, cv2.COLOR_BGR2RGB, dst=resized_buffer)
+    np.divide(resized_buffer.transpose(2, 0, 1), 255.0, out=chw_buffer, casting="unsafe")
+    return chw_buffer
+
+def _yolov5_people_boxes(predictions, frame_w, frame_h):
+    """
+    Filtra la salida cruda de YOLOv5 ((N, 85): cx, cy, w, h en píxeles de entrada, objectness y clases)
+    y devuelve las personas en coordenadas del frame original, tras NMS.
+    """
+    # Descartar primero por objectness: es barato y elimina casi todas las filas
+    candidates = predictions[predictions[:, 4] > PERSON_CONFIDENCE_THRESHOLD]
+    if not len(candidates):
+        return []
+    class_scores = candidates[:, 5:] * candidates[:, 4:5]
+    confidences = class_scores[:, PERSON_CLASS_ID]
+    mask = (class_scores.argmax(axis=1) == PERSON_CLASS_ID) & (confidences > PERSON_CONFIDENCE_THRESHOLD)
+    if not mask.any():
+        return []
+
+    people = candidates[mask]
+    scale_x = frame_w / YOLOV5_INPUT_SIZE[0]
+    scale_y = frame_h / YOLOV5_INPUT_SIZE[1]
+    widths = people[:, 2] * scale_x
+    heights = people[:, 3] * scale_y
+    boxes_xywh = np.stack([people[:, 0] * scale_x - widths / 2, people[:, 1] * scale_y - heights / 2, widths, heights], axis=1)
+    return _nms_people_boxes(boxes_xywh, confidences[mask])
+
+def export_yolov5n_onnx(output_path=ONNX_FP32_MODEL_PATH):
+    """Exporta YOLOv5n (PyTorch Hub) a ONNX en FP32 con la salida cruda (lote, N, 85) y lote dinámico."""
+    import torch
+
+    model = torch.hub.load('ultralytics/yolov5', 'yolov5n', pretrained=True, autoshape=False)
+    model.eval()
+    for m in model.modules():
+        if m.__class__.__name__ == "Detect":
+            m.inplace = False
+            m.export = True # Devuelve solo la salida concatenada, como export.py de YOLOv5
+
+    dummy = torch.zeros(1, 3, YOLOV5_INPUT_SIZE[1], YOLOV5_INPUT_SIZE[0])
+    torch.onnx.export(model, dummy, output_path, opset_version=12,
+                      input_names=["images"], output_names=["output0"],
+                      dynamic_axes={"images": {0: "batch"}, "output0": {0: "batch"}}) # Para DetectorService
+    print(f"INFO: YOLOv5n exportado a {output_path}")
+    return output_path
+
+def build_tensorrt_engine(onnx_path, engine_path, max_batch=DETECTION_BATCH_SIZE):
+    """Compila el modelo ONNX a un engine de TensorRT en FP16 y lo guarda en 'engine_path'."""
+    logger = trt.Logger(trt.Logger.WARNING)
+    builder = trt.Builder(logger)
+    network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+    parser = trt.OnnxParser(network, logger)
+    with open(onnx_path, "rb") as f:
+        if not parser.parse(f.read()):
+            errors = "; ".join(str(parser.get_error(i)) for i in range(parser.num_errors))
+            raise RuntimeError(f"No se pudo interpretar {onnx_path}: {errors}")
+
+    config = builder.create_builder_config()
+    config.set_memory_pool_limit(trt.MemoryPoolType.WORKSPACE, TENSORRT_WORKSPACE_BYTES)
+    if builder.platform_has_fast_fp16:
+        config.set_flag(trt.BuilderFlag.FP16)
+    # El ONNX se exporta con lote dinámico: el engine admite de 1 a max_batch frames
+    input_shape = (3, YOLOV5_INPUT_SIZE[1], YOLOV5_INPUT_SIZE[0])
+    profile = builder.create_optimization_profile()
+    profile.set_shape(network.get_input(0).name, (1, *input_shape), (1, *input_shape), (max_batch, *input_shape))
+    config.add_optimization_profile(profile)
+
+    serialized_engine = builder.build_serialized_network(network, config)
+    if serialized_engine is None:
+        raise RuntimeError(f"TensorRT no pudo compilar {onnx_path}")
+    with open(engine_path, "wb") as f:
+        f.write(serialized_engine)
+    print(f"INFO: Engine de TensorRT (FP16) guardado en {engine_path}")
+    return engine_path
+
+class TensorRTYoloV5:
+    """
+    YOLOv5n compilado con TensorRT. Se usa como el modelo de PyTorch Hub, model(frame), pero devuelve
+    directamente la lista de personas detectadas con el formato del resto de detectores.
+    Los buffers de entrada y salida son tensores CUDA de torch reservados una sola vez para el lote máximo.
+    Los frames se suben como uint8 desde memoria fijada (pinned), con copias asíncronas en su propio
+    stream; la conversión a RGB float 0..1 se hace en la GPU.
+    """
+    def __init__(self, engine_path, max_batch=DETECTION_BATCH_SIZE):
+        logger = trt.Logger(trt.Logger.WARNING)
+        with open(engine_path, "rb") as f:
+            self.engine = trt.Runtime(logger).deserialize_cuda_engine(f.read())
+        if self.engine is None:
+            raise RuntimeError(f"No se pudo deserializar {engine_path}")
+        self.context = self.engine.create_execution_context()
+        names = [self.engine.get_tensor_name(i) for i in range(self.engine.num_io_tensors)]
+        self.input_name = next(n for n in names if self.engine.get_tensor_mode(n) == trt.TensorIOMode.INPUT)
+        self.output_name = next(n for n in names if self.engine.get_tensor_mode(n) == trt.TensorIOMode.OUTPUT)
+        self.stream = torch.cuda.Stream()
+        self.max_batch = max_batch
+
+        input_shape = (max_batch, 3, YOLOV5_INPUT_SIZE[1], YOLOV5_INPUT_SIZE[0])
+        self.context.set_input_shape(self.input_name, input_shape)
+        self.batch = max_batch # Tamaño de lote configurado actualmente en el contexto
+        self.device_input = torch.empty(input_shape, dtype=torch.float32, device="cuda")
+        self.device_output = torch.empty(tuple(self.context.get_tensor_shape(self.output_name)),
+                                         dtype=torch.float32, device="cuda")
+        # Con lotes menores TensorRT usa el inicio de los mismos buffers (son contiguos por lote)
+        self.context.set_tensor_address(self.input_name, self.device_input.data_ptr())
+        self.context.set_tensor_address(self.output_name, self.device_output.data_ptr())
+        # Staging en memoria fijada: el resize escribe directamente en ella (vista numpy) y la copia a la
+        # GPU es DMA asíncrona. En uint8 se transfiere la cuarta parte de bytes que en float32.
+        frames_shape = (max_batch, YOLOV5_INPUT_SIZE[1], YOLOV5_INPUT_SIZE[0], 3)
+        self.pinned_frames = torch.empty(frames_shape, dtype=torch.uint8, pin_memory=True)
+        self.host_frames = self.pinned_frames.numpy()
+        self.device_frames = torch.empty(frames_shape, dtype=torch.uint8, device="cuda")
+        self.pinned_output = torch.empty(self.device_output.shape, dtype=torch.float32, pin_memory=True)
+
+    def __call__(self, frame):
+        return self.infer([frame])[0]
+
+    def infer(self, frames):
+        """Ejecuta el engine sobre una lista de frames. Devuelve una lista de detalles por frame."""
+        if len(frames) > self.max_batch:
+            return self.infer(frames[:self.max_batch]) + self.infer(frames[self.max_batch:])
+
+        n = len(frames)
+        for i, frame in enumerate(frames):
+            cv2.resize(frame, YOLOV5_INPUT_SIZE, dst=self.host_frames[i], interpolation=cv2.INTER_LINEAR)
+        if n != self.batch:
+            self.context.set_input_shape(self.input_name, (n, 3, YOLOV5_INPUT_SIZE[1], YOLOV5_INPUT_SIZE[0]))
+            self.batch = n
+        with torch.cuda.stream(self.stream):
+            self.device_frames[:n].copy_(self.pinned_frames[:n], non_blocking=True)
+            # BGR uint8 (N, H, W, 3) -> RGB float32 (N, 3, H, W) en 0..1, igual que preprocess_yolov5
+            self.device_input[:n].copy_(self.device_frames[:n].flip(3).permute(0, 3, 1, 2))
+            self.device_input[:n].div_(255.0)
+            self.context.execute_async_v3(self.stream.cuda_stream)
+            self.pinned_output[:n].copy_(self.device_output[:n], non_blocking=True)
+        self.stream.synchronize() # Única espera: cuando ya hacen falta los resultados en CPU
+        outputs = self.pinned_output[:n].numpy()
+        return [_yolov5_people_boxes(predictions, frame.shape[1], frame.shape[0])
+                for frame, predictions in zip(frames, outputs)]
+
+def _load_tensorrt_model():
+    """
+    Devuelve el modelo YOLOv5n en TensorRT, compilando el engine la primera vez.
+    Devuelve None si no se pudo (se usa entonces el modelo de PyTorch Hub).
+    """
+    try:
+        if not os.path.exists(TENSORRT_ENGINE_PATH):
+            os.makedirs(MODELS_DIR, exist_ok=True)
+            if not os.path.exists(ONNX_FP32_MODEL_PATH):
+                export_yolov5n_onnx(ONNX_FP32_MODEL_PATH)
+            print("INFO: Compilando YOLOv5n con TensorRT (solo la primera vez, puede tardar unos minutos)...")
+            build_tensorrt_engine(ONNX_FP32_MODEL_PATH, TENSORRT_ENGINE_PATH)
+        model = TensorRTYoloV5(TENSORRT_ENGINE_PATH)
+    except Exception as e:
+        print(f"ERROR: Al preparar YOLOv5n con TensorRT: {e}. Se usará PyTorch.")
+        return None
+    print("INFO: Modelo YOLOv5n cargado con TensorRT (FP16).")
+    return model
+
+def _compile_pytorch_model(model):
+    """
+    Pasa la red a channels_last (convoluciones NHWC de cuDNN, mejores para Tensor Cores) y la compila
+    con torch.compile. Se compila el nn.Module interno, no AutoShape, cuyo pre/postproceso es Python.
+    Hace una inferencia de calentamiento para no pagar la compilación con el primer frame real.
+    """
+    network = model.model.to(memory_format=torch.channels_last)
+    model.model = network
+    if not hasattr(torch, "compile"): # PyTorch < 2.0
+        return
+    try:
+        # Modo por defecto con formas dinámicas: los lotes (1 a DETECTION_BATCH_SIZE) y los letterbox de cada
+        # cámara cambian de forma; "reduce-overhead" grabaría un grafo CUDA por forma sobre frames reales
+        model.model = torch.compile(network, dynamic=True)
+        # Frame 16:9 (lo habitual en cámaras IP) ya reducido al lado mayor de trabajo
+        warmup_frame = np.zeros((YOLOV5_INPUT_SIZE[0] * 9 // 16, YOLOV5_INPUT_SIZE[0], 3), dtype=np.uint8)
+        with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16, enabled=PYTORCH_FP16):
+            model([warmup_frame])
+        print("INFO: YOLOv5n compilado con torch.compile (channels_last).")
+    except Exception as e:
+        model.model = network
+        print(f"WARN: No se pudo compilar YOLOv5n con torch.compile: {e}. Se usará sin compilar.")
+
 def _initialize_pytorch_model():
-    """Carga el modelo YOLOv5 si aún no está cargado."""
-    global DETECTION_MODEL_INSTANCE
+    """Carga el modelo YOLOv5 (engine de TensorRT si es posible) si aún no está cargado."""
+    global DETECTION_MODEL_INSTANCE, PYTORCH_FP16
     if DETECTION_MODEL_INSTANCE is None and MODEL_TYPE == "pytorch_yolov5":
+        if TENSORRT_AVAILABLE and torch.cuda.is_available():
+            DETECTION_MODEL_INSTANCE = _load_tensorrt_model()
+            if DETECTION_MODEL_INSTANCE is not None:
+                # Sin letterbox: reducir directamente a la entrada del engine (un solo resize por frame)
+                DETECTION_INPUT_SIZE["pytorch_yolov5"] = YOLOV5_INPUT_SIZE
+                FRAME_SCALES.clear()
+                return DETECTION_MODEL_INSTANCE
         try:
             DETECTION_MODEL_INSTANCE = torch.hub.load('ultralytics/yolov5', 'yolov5n', pretrained=True) # Usar yolov5n (nano)
-            # Opcional: configurar para detectar solo personas (clase 0 en COCO)
-            # DETECTION_MODEL_INSTANCE.classes = [0]
+            # Detectar solo personas (clase 0 en COCO) y filtrar por confianza dentro del NMS del modelo
+            DETECTION_MODEL_INSTANCE.classes = [PERSON_CLASS_ID]
+            DETECTION_MODEL_INSTANCE.conf = PERSON_CONFIDENCE_THRESHOLD
+            if torch.cuda.is_available():
+                DETECTION_MODEL_INSTANCE = DETECTION_MODEL_INSTANCE.cuda().eval()
+                if torch.cuda.get_device_capability()[0] >= PYTORCH_FP16_MIN_CAPABILITY:
+                    # FP16 en GPU: pesos con la mitad de ancho de banda y uso de Tensor Cores.
+                    # AutoShape convierte la entrada al dtype del modelo, así que el frame se sigue pasando tal cual.
+                    DETECTION_MODEL_INSTANCE = DETECTION_MODEL_INSTANCE.half()
+                    PYTORCH_FP16 = True
+                    print("INFO: YOLOv5n en GPU con precisión FP16.")
+                else:
+                    print("INFO: YOLOv5n en GPU con precisión FP32 (la GPU no tiene Tensor Cores).")
+                if PYTORCH_COMPILE:
+                    _compile_pytorch_model(DETECTION_MODEL_INSTANCE)
             print("INFO: Modelo YOLOv5n (PyTorch Hub) cargado exitosamente.")
         except Exception as e:
             print(f"ERROR: Al cargar modelo YOLOv5n desde PyTorch Hub: {e}")
@@ -54,102 +516,569 @@ def _initialize_pytorch_model():
     return DETECTION_MODEL_INSTANCE if DETECTION_MODEL_INSTANCE != "error" else None
 
 def detect_objects_pytorch(frame):
-    """Detecta objetos (personas) usando YOLOv5 (PyTorch). Devuelve True si se detectan personas."""
+    """Detecta objetos (personas) usando YOLOv5 (PyTorch o TensorRT). Devuelve True si se detectan personas."""
+    return detect_objects_pytorch_batch([frame])[0]
+
+def detect_objects_pytorch_batch(frames):
+    """
+    Versión por lotes de detect_objects_pytorch: una sola inferencia para todos los frames
+    (AutoShape acepta una lista de imágenes; el engine de TensorRT tiene lote dinámico).
+    Devuelve una lista de (detección, detalles).
+    """
     model = _initialize_pytorch_model()
     if not model:
-        return False, [] # No hay modelo, no hay detección
+        return [(False, []) for _ in frames] # No hay modelo, no hay detección
 
-    results = model(frame)
-    predictions = results.pandas().xyxy[0]
+    if isinstance(model, TensorRTYoloV5):
+        return [(len(boxes) > 0, boxes) for boxes in model.infer(frames)]
 
-    detected_people_boxes = []
-    for _, row in predictions.iterrows():
-        if row['name'] == 'person' and row['confidence'] > 0.4: # Filtrar por clase 'person' y confianza
-            xmin, ymin, xmax, ymax = int(row['xmin']), int(row['ymin']), int(row['xmax']), int(row['ymax'])
-            detected_people_boxes.append({
-                "box": [xmin, ymin, xmax, ymax],
-                "confidence": row['confidence']
-            })
+    # Sin registro de autograd, solo inferencia; en GPUs con Tensor Cores las operaciones se ejecutan en FP16
+    with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16, enabled=PYTORCH_FP16):
+        results = model(frames)
+    detections = []
+    # Un tensor (N, 6) por frame: xmin, ymin, xmax, ymax, confianza, clase. Sin pasar por un DataFrame de pandas.
+    for frame_predictions in results.xyxy:
+        # Filtrar en el dispositivo del modelo y copiar a CPU solo las filas de personas
+        mask = (frame_predictions[:, 5] == PERSON_CLASS_ID) & (frame_predictions[:, 4] > PERSON_CONFIDENCE_THRESHOLD)
+        people = frame_predictions[mask].float().cpu().numpy()
+        detected_people_boxes = [{"box": [int(xmin), int(ymin), int(xmax), int(ymax)], "confidence": float(conf)}
+                                 for xmin, ymin, xmax, ymax, conf, _ in people]
+        detections.append((len(detected_people_boxes) > 0, detected_people_boxes))
+    return detections
+
+def _darknet_people_boxes(detections, frame_w, frame_h):
+    """
+    Filtra la salida de YOLOv4-tiny ((N, 85): cx, cy, w, h normalizados, objectness y una puntuación
+    por clase) y devuelve las personas en coordenadas del frame, tras NMS.
+    """
+    scores = detections[:, 5:]
+    class_ids = scores.argmax(axis=1)
+    confidences = scores.max(axis=1)
+    mask = (class_ids == PERSON_CLASS_ID) & (confidences > PERSON_CONFIDENCE_THRESHOLD)
+    if not mask.any():
+        return []
 
-    return len(detected_people_boxes) > 0, detected_people_boxes
+    people = detections[mask]
+    widths = people[:, 2] * frame_w
+    heights = people[:, 3] * frame_h
+    boxes_xywh = np.stack([people[:, 0] * frame_w - widths / 2, people[:, 1] * frame_h - heights / 2, widths, heights], axis=1)
+    return _nms_people_boxes(boxes_xywh, confidences[mask])
 
 def detect_objects_cvlib(frame):
-    """Detecta objetos (personas) usando cvlib. Devuelve True si se detectan personas."""
+    """
+    Detecta personas con YOLOv4-tiny ejecutado directamente en OpenCV DNN
+    (mismo modelo que usaba cvlib, sin su envoltorio por frame). Devuelve True si se detectan personas.
+    """
+    return detect_objects_cvlib_batch([frame])[0]
+
+def detect_objects_cvlib_batch(frames):
+    """
+    Versión por lotes de detect_objects_cvlib: un único blob (N, 3, 416, 416) y un solo forward
+    de la red compartida. Devuelve una lista de (detección, detalles).
+    """
+    if DNN_NET is None:
+        return [(False, []) for _ in frames] # No hay modelo, no hay detección
+
     try:
-        # confidence=0.4 es un umbral razonable. model='yolov4-tiny' es más rápido.
-        bbox, label, conf = cvlib.detect_common_objects(frame, confidence=0.4, model='yolov4-tiny', enable_gpu=False)
-    except NameError: # cvlib no importado
-        print("ERROR: cvlib no está disponible (NameError). No se puede realizar la detección.")
-        return False, []
+        blob = cv2.dnn.blobFromImages(frames, 1 / 255.0, YOLO_INPUT_SIZE, swapRB=True, crop=False)
+        with DNN_LOCK:
+            DNN_NET.setInput(blob)
+            outs = DNN_NET.forward(DNN_OUTPUT_LAYERS)
+    except cv2.error as e:
+        print(f"ERROR: Durante la detección con OpenCV DNN: {e}")
+        return [(False, []) for _ in frames]
+
+    # Con lote 1 cada salida es (filas, 85); con lote N es (N, filas, 85)
+    per_frame = np.concatenate([out.reshape(len(frames), -1, out.shape[-1]) for out in outs], axis=1)
+    results = []
+    for frame, detections in zip(frames, per_frame):
+        frame_h, frame_w = frame.shape[:2]
+        detected_people_boxes = _darknet_people_boxes(detections, frame_w, frame_h)
+        results.append((len(detected_people_boxes) > 0, detected_people_boxes))
+    return results
+
+def detect_objects_onnx(frame):
+    """Detecta personas con YOLOv5n (FP32 o INT8) en ONNX Runtime. Devuelve True si se detectan personas."""
+    return detect_objects_onnx_batch([frame])[0]
+
+def detect_objects_onnx_batch(frames):
+    """
+    Versión por lotes de detect_objects_onnx: una sola llamada a session.run para todos los frames
+    (si el modelo se exportó con lote dinámico). Devuelve una lista de (detección, detalles).
+    """
+    if ONNX_SESSION is None:
+        return [(False, []) for _ in frames] # No hay sesión, no hay detección
+    return _yolov5_cpu_batch(frames, lambda blob: ONNX_SESSION.run(None, {ONNX_INPUT_NAME: blob})[0], "ONNX Runtime")
+
+def detect_objects_openvino(frame):
+    """Detecta personas con YOLOv5n INT8 en OpenVINO. Devuelve True si se detectan personas."""
+    return detect_objects_openvino_batch([frame])[0]
+
+def detect_objects_openvino_batch(frames):
+    """Versión por lotes de detect_objects_openvino. Devuelve una lista de (detección, detalles)."""
+    if OPENVINO_MODEL is None:
+        return [(False, []) for _ in frames] # No hay modelo, no hay detección
+    return _yolov5_cpu_batch(frames, lambda blob: OPENVINO_MODEL(blob)[OPENVINO_MODEL.output(0)], "OpenVINO")
+
+def _yolov5_cpu_batch(frames, infer, backend_name):
+    """
+    Preproceso, inferencia y postproceso de YOLOv5n comunes a ONNX Runtime y OpenVINO.
+    'infer' recibe el blob (N, 3, H, W) y devuelve la salida cruda (N, filas, 85).
+    """
+    if len(frames) > 1 and (not ONNX_DYNAMIC_BATCH or len(frames) > len(ONNX_INPUT_BUFFER)):
+        return [_yolov5_cpu_batch([frame], infer, backend_name)[0] for frame in frames]
+
+    try:
+        with ONNX_LOCK:
+            for i, frame in enumerate(frames):
+                preprocess_yolov5(frame, ONNX_RESIZED_BUFFER, ONNX_INPUT_BUFFER[i])
+            predictions_batch = infer(ONNX_INPUT_BUFFER[:len(frames)])
     except Exception as e:
-        print(f"ERROR: Durante la detección con cvlib: {e}")
+        print(f"ERROR: Durante la detección con {backend_name}: {e}")
+        return [(False, []) for _ in frames]
+
+    results = []
+    for frame, predictions in zip(frames, predictions_batch):
+        frame_h, frame_w = frame.shape[:2]
+        detected_people_boxes = _yolov5_people_boxes(predictions, frame_w, frame_h)
+        results.append((len(detected_people_boxes) > 0, detected_people_boxes))
+    return results
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def motion_pipeline(prev_blur, cur_bgr, blur_out, blur_tmp, mask_tmp, mask_out, thresh):
+        """
+        Kernel fusionado equivalente a cvtColor + GaussianBlur(21x21) + absdiff + threshold + dilate(x2).
+        Recorre la imagen por bloques de MOTION_TILE_ROWS filas en paralelo. El desenfoque son tres
+        pasadas de caja 7x7 separables (sigma ~3.46, prácticamente la gaussiana 21x21 de OpenCV, sigma 3.5).
+        Escribe el frame desenfocado en 'blur_out' y la máscara de movimiento (0/255) en 'mask_out'.
+        """
+        h, w = blur_out.shape
+        n_tiles = (h + MOTION_TILE_ROWS - 1) // MOTION_TILE_ROWS
+
+        # 1) BGR -> gris
+        for t in prange(n_tiles):
+            for y in range(t * MOTION_TILE_ROWS, min(h, (t + 1) * MOTION_TILE_ROWS)):
+                for x in range(w):
+                    blur_out[y, x] = 0.114 * cur_bgr[y, x, 0] + 0.587 * cur_bgr[y, x, 1] + 0.299 * cur_bgr[y, x, 2]
+
+        # 2) Desenfoque: 3 x (caja horizontal de 7 + caja vertical de 7), borde replicado
+        for _ in range(3):
+            for t in prange(n_tiles):
+                for y in range(t * MOTION_TILE_ROWS, min(h, (t + 1) * MOTION_TILE_ROWS)):
+                    for x in range(w):
+                        acc = 0.0
+                        for k in range(-3, 4):
+                            acc += blur_out[y, min(max(x + k, 0), w - 1)]
+                        blur_tmp[y, x] = acc / 7.0
+            for t in prange(n_tiles):
+                for y in range(t * MOTION_TILE_ROWS, min(h, (t + 1) * MOTION_TILE_ROWS)):
+                    for x in range(w):
+                        acc = 0.0
+                        for k in range(-3, 4):
+                            acc += blur_tmp[min(max(y + k, 0), h - 1), x]
+                        blur_out[y, x] = acc / 7.0
+
+        # 3) Diferencia con el frame anterior + umbral, y 4) dilatación 5x5 (= dos dilataciones 3x3)
+        for t in prange(n_tiles):
+            for y in range(t * MOTION_TILE_ROWS, min(h, (t + 1) * MOTION_TILE_ROWS)):
+                for x in range(w):
+                    found = 0
+                    for k in range(-2, 3):
+                        xx = min(max(x + k, 0), w - 1)
+                        if abs(blur_out[y, xx] - prev_blur[y, xx]) > thresh:
+                            found = 255
+                            break
+                    mask_tmp[y, x] = found
+        for t in prange(n_tiles):
+            for y in range(t * MOTION_TILE_ROWS, min(h, (t + 1) * MOTION_TILE_ROWS)):
+                for x in range(w):
+                    found = 0
+                    for k in range(-2, 3):
+                        if mask_tmp[min(max(y + k, 0), h - 1), x]:
+                            found = 255
+                            break
+                    mask_out[y, x] = found
+
+def _opencl_gpu_available():
+    """Indica si OpenCV puede ejecutar la T-API (UMat) en una GPU OpenCL. En CPU no compensa la copia."""
+    if not cv2.ocl.haveOpenCL():
+        return False
+    cv2.ocl.setUseOpenCL(True)
+    device = cv2.ocl.Device.getDefault()
+    return device.available() and bool(device.type() & cv2.ocl.Device_TYPE_GPU)
+
+MOTION_USE_OPENCL = _opencl_gpu_available() # También la usa motion_gate con los demás modelos
+if MOTION_USE_OPENCL:
+    print("INFO: GPU OpenCL disponible, la detección de movimiento usará la T-API de OpenCV (UMat).")
+
+def _motion_areas(mask, min_area):
+    """Extrae las zonas de movimiento (cajas) de una máscara binaria, descartando las de área menor a 'min_area'."""
+    # Una sola llamada en C devuelve área y caja de cada componente; el filtrado se hace vectorizado.
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    components = stats[1:] # La etiqueta 0 es el fondo
+    selected = components[components[:, cv2.CC_STAT_AREA] >= min_area]
+    if not len(selected):
         return False, []
 
-    detected_people_boxes = []
-    for l, c, b in zip(label, conf, bbox):
-        if l == 'person':
-            detected_people_boxes.append({
-                "box": [b[0], b[1], b[2], b[3]], # xmin, ymin, xmax, ymax
-                "confidence": c
-            })
+    # Aunque no es "persona", damos un box. No es necesario dibujar aquí, ya que no hay GUI.
+    detected_motion_areas = [{"box": [int(x), int(y), int(x + w), int(y + h)]}
+                             for x, y, w, h in selected[:, :cv2.CC_STAT_AREA]]
+    return True, detected_motion_areas
 
-    return len(detected_people_boxes) > 0, detected_people_boxes
+def _detect_simple_motion_numba(frame, camera_id, min_area):
+    """Versión de detect_simple_motion basada en motion_pipeline, con buffers persistentes por cámara."""
+    frame_h, frame_w = frame.shape[:2]
+    buffers = MOTION_NUMBA_BUFFERS.get(camera_id)
+    first_frame = buffers is None or buffers["blur"].shape != (frame_h, frame_w)
+    if first_frame:
+        buffers = {
+            "prev": np.zeros((frame_h, frame_w), dtype=np.float32),
+            "blur": np.empty((frame_h, frame_w), dtype=np.float32),
+            "blur_tmp": np.empty((frame_h, frame_w), dtype=np.float32),
+            "mask_tmp": np.empty((frame_h, frame_w), dtype=np.uint8),
+            "mask": np.empty((frame_h, frame_w), dtype=np.uint8),
+        }
+        MOTION_NUMBA_BUFFERS[camera_id] = buffers
 
-def detect_simple_motion(frame, camera_id):
-    """Detección de movimiento simple. Devuelve True si se detecta movimiento significativo."""
-    global PREVIOUS_FRAMES_FOR_MOTION
+    motion_pipeline(buffers["prev"], np.ascontiguousarray(frame), buffers["blur"], buffers["blur_tmp"],
+                    buffers["mask_tmp"], buffers["mask"], MOTION_THRESHOLD)
+    # El frame desenfocado actual pasa a ser el anterior sin copiarlo
+    buffers["prev"], buffers["blur"] = buffers["blur"], buffers["prev"]
 
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    gray = cv2.GaussianBlur(gray, (21, 21), 0)
+    if first_frame:
+        return False, [] # No hay frame anterior, no hay detección de movimiento
+    return _motion_areas(buffers["mask"], min_area)
 
-    if camera_id not in PREVIOUS_FRAMES_FOR_MOTION:
-        PREVIOUS_FRAMES_FOR_MOTION[camera_id] = gray
+def _detect_simple_motion_opencl(frame, camera_id, min_area):
+    """
+    Versión de detect_simple_motion con UMat: la cadena completa se ejecuta en la GPU (OpenCL)
+    y solo se descarga la máscara final para extraer las zonas de movimiento.
+    """
+    gray = cv2.cvtColor(cv2.UMat(frame), cv2.COLOR_BGR2GRAY)
+    gray = cv2.sepFilter2D(gray, -1, MOTION_GAUSSIAN_KERNEL, MOTION_GAUSSIAN_KERNEL)
+
+    previous = MOTION_OPENCL_PREVIOUS.get(camera_id)
+    MOTION_OPENCL_PREVIOUS[camera_id] = (frame.shape[:2], gray) # El frame actual pasa a ser el anterior sin copiarlo
+    if previous is None or previous[0] != frame.shape[:2]:
         return False, [] # No hay frame anterior, no hay detección de movimiento
 
-    frame_delta = cv2.absdiff(PREVIOUS_FRAMES_FOR_MOTION[camera_id], gray)
-    thresh = cv2.threshold(frame_delta, 30, 255, cv2.THRESH_BINARY)[1] # Umbral más alto para movimiento
-    thresh = cv2.dilate(thresh, None, iterations=2)
+    delta = cv2.absdiff(previous[1], gray)
+    _, thresh = cv2.threshold(delta, MOTION_THRESHOLD, 255, cv2.THRESH_BINARY)
+    mask = cv2.dilate(thresh, MOTION_DILATE_KERNEL)
+    return _motion_areas(mask.get(), min_area)
+
+def detect_simple_motion(frame, camera_id, min_area=MOTION_MIN_AREA):
+    """
+    Detección de movimiento simple. Devuelve True si se detecta movimiento significativo.
+    'min_area' es el área mínima de un contorno, en píxeles del frame recibido.
+    """
+    if MOTION_USE_OPENCL:
+        return _detect_simple_motion_opencl(frame, camera_id, min_area)
+    if NUMBA_AVAILABLE:
+        return _detect_simple_motion_numba(frame, camera_id, min_area)
+
+    frame_h, frame_w = frame.shape[:2]
+    previous = PREVIOUS_FRAMES_FOR_MOTION.get(camera_id)
+    first_frame = previous is None or previous.shape != (frame_h, frame_w)
+    if first_frame:
+        # Primer frame (o cambio de resolución): reservar los buffers de esta cámara una sola vez
+        previous = np.empty((frame_h, frame_w), dtype=np.uint8)
+        MOTION_SCRATCH[camera_id] = {name: np.empty_like(previous) for name in ("gray", "blur", "delta", "thresh", "mask")}
+    scratch = MOTION_SCRATCH[camera_id]
 
-    contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=scratch["gray"])
+    # Mismo resultado que GaussianBlur((21, 21), 0) (borde BORDER_REFLECT_101), sin reconstruir el kernel
+    cv2.sepFilter2D(scratch["gray"], -1, MOTION_GAUSSIAN_KERNEL, MOTION_GAUSSIAN_KERNEL, dst=scratch["blur"])
 
-    PREVIOUS_FRAMES_FOR_MOTION[camera_id] = gray # Actualizar frame anterior
+    if not first_frame:
+        cv2.absdiff(previous, scratch["blur"], dst=scratch["delta"])
+        cv2.threshold(scratch["delta"], MOTION_THRESHOLD, 255, cv2.THRESH_BINARY, dst=scratch["thresh"]) # Umbral más alto para movimiento
+        cv2.dilate(scratch["thresh"], MOTION_DILATE_KERNEL, dst=scratch["mask"])
 
-    motion_found = False
-    detected_motion_areas = []
-    min_area = 700 # Área mínima para considerar un contorno como movimiento relevante
-    for contour in contours:
-        if cv2.contourArea(contour) < min_area:
-            continue
-        motion_found = True
-        (x, y, w, h) = cv2.boundingRect(contour)
-        detected_motion_areas.append({"box": [x, y, x + w, y + h]}) # Aunque no es "persona", damos un box
-        # No es necesario dibujar aquí, ya que no hay GUI.
+    # El frame desenfocado actual pasa a ser el anterior intercambiando los buffers, sin copiarlo
+    PREVIOUS_FRAMES_FOR_MOTION[camera_id], scratch["blur"] = scratch["blur"], previous
+
+    if first_frame:
+        return False, [] # No hay frame anterior, no hay detección de movimiento
+    return _motion_areas(scratch["mask"], min_area)
+
+def _get_frame_scale(camera_id, frame_shape):
+    """
+    Devuelve (y cachea por cámara) el tamaño de trabajo (ancho, alto) del detector para el frame
+    y la escala (sx, sy) de cada eje respecto al frame original.
+    """
+    size = frame_shape[:2]
+    cached = FRAME_SCALES.get(camera_id)
+    if cached is not None and cached[0] == size:
+        return cached[1], cached[2]
+    frame_h, frame_w = size
+    target_size = DETECTION_INPUT_SIZE.get(MODEL_TYPE)
+    if target_size is None:
+        max_side = DETECTION_MAX_SIDE.get(MODEL_TYPE)
+        ratio = min(1.0, max_side / max(size)) if max_side else 1.0
+        target_size = (max(1, int(round(frame_w * ratio))), max(1, int(round(frame_h * ratio))))
+    scale = (target_size[0] / frame_w, target_size[1] / frame_h)
+    FRAME_SCALES[camera_id] = (size, target_size, scale)
+    return target_size, scale
+
+def _resolve_detect_fn(model_type):
+    """
+    Devuelve la función de detección para 'model_type', con firma (frame, camera_id, (sx, sy)).
+    Se resuelve una vez para no comparar cadenas de MODEL_TYPE en cada frame.
+    """
+    return {
+        "cvlib_yolov4_tiny": lambda frame, camera_id, scale: detect_objects_cvlib(frame),
+        "pytorch_yolov5": lambda frame, camera_id, scale: detect_objects_pytorch(frame),
+        "onnx_yolov5n": lambda frame, camera_id, scale: detect_objects_onnx(frame),
+        "onnx_yolov5n_int8": lambda frame, camera_id, scale: detect_objects_onnx(frame),
+        "openvino_int8": lambda frame, camera_id, scale: detect_objects_openvino(frame),
+        "simple_motion": lambda frame, camera_id, scale: detect_simple_motion(frame, camera_id, MOTION_MIN_AREA * scale[0] * scale[1]),
+    }.get(model_type, lambda frame, camera_id, scale: (False, [])) # Modelo no reconocido: no hacer nada
+
+DETECT_FN = _resolve_detect_fn(MODEL_TYPE)
+
+def _downscale_frame(frame, camera_id):
+    """Lleva el frame a la resolución de trabajo del detector. Devuelve (frame_reducido, (sx, sy))."""
+    target_size, scale = _get_frame_scale(camera_id, frame.shape)
+    if target_size != (frame.shape[1], frame.shape[0]):
+        # INTER_LINEAR es la misma interpolación que usaba el resize interno de cada modelo
+        interpolation = cv2.INTER_LINEAR if MODEL_TYPE in DETECTION_INPUT_SIZE else cv2.INTER_AREA
+        frame = cv2.resize(frame, target_size, interpolation=interpolation)
+    return frame, scale
+
+def _restore_box_scale(detection_details, scale):
+    """Devuelve las cajas de los detalles a coordenadas del frame original, con la escala de cada eje."""
+    sx, sy = scale
+    if sx != 1.0 or sy != 1.0:
+        for detail in detection_details:
+            xmin, ymin, xmax, ymax = detail["box"]
+            detail["box"] = [int(round(xmin / sx)), int(round(ymin / sy)), int(round(xmax / sx)), int(round(ymax / sy))]
+    return detection_details
+
+def _analyze_downscaled(frame, camera_id, scale):
+    """Analiza un frame ya reducido con _downscale_frame y devuelve las cajas en coordenadas del original."""
+    load_detection_model()
+    # DETECT_FN se resuelve una sola vez al importar según MODEL_TYPE (ver _resolve_detect_fn)
+    detection_made, detection_details = DETECT_FN(frame, camera_id, scale)
 
-    return motion_found, detected_motion_areas
+    # Volver a las coordenadas del frame original para el payload de la alerta
+    _restore_box_scale(detection_details, scale)
+    return detection_made, detection_details
 
 def analyze_frame(frame, camera_id):
     """
     Función principal para analizar un frame y detectar personas o movimiento.
     No dibuja en el frame. Devuelve un booleano (detección sí/no) y una lista de detalles de detección.
+    Las cajas de los detalles se expresan siempre en coordenadas del frame original.
     """
-    start_time = time.time()
-    detection_made = False
-    detection_details = [] # Lista de dicts, cada dict representa una detección
+    load_detection_model() # El tamaño de trabajo puede depender del modelo cargado
+    frame, scale = _downscale_frame(frame, camera_id)
+    return _analyze_downscaled(frame, camera_id, scale)
 
-    if MODEL_TYPE == "cvlib_yolov4_tiny":
-        detection_made, detection_details = detect_objects_cvlib(frame)
-    elif MODEL_TYPE == "pytorch_yolov5":
-        detection_made, detection_details = detect_objects_pytorch(frame)
-    elif MODEL_TYPE == "simple_motion":
-        detection_made, detection_details = detect_simple_motion(frame, camera_id)
-    else:
-        # No hacer nada si el modelo no es reconocido
-        pass
+def motion_gate(frame, camera_id):
+    """
+    Indica si hubo movimiento significativo respecto al frame anterior de la cámara.
+    Es la detección de movimiento simple sobre una copia reducida del frame, con su propio
+    frame previo por cámara, para decidir entre ejecuciones del detector si hace falta adelantarlo.
+    """
+    scale = min(1.0, MOTION_GATE_MAX_SIDE / max(frame.shape[:2]))
+    if scale < 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    motion_detected, _ = detect_simple_motion(frame, f"{camera_id}#gate", MOTION_MIN_AREA * scale * scale)
+    return motion_detected
 
-    end_time = time.time()
-    # print(f"DEBUG: Detección en {camera_id} tomó {end_time - start_time:.4f}s. Detección: {detection_made}")
+def motion_gate_open(frame, camera_id):
+    """
+    Filtro de "motion_gated_yolo": True si hay movimiento en el frame o lo hubo hace menos de
+    MOTION_GATE_STICKY_SECONDS. Lo llama cada cámara (en su pool de E/S, con el frame original para que
+    MOTION_MIN_AREA mantenga su escala) antes de enviar el frame al detector.
+    """
+    now = time.monotonic()
+    if motion_gate(frame, camera_id):
+        MOTION_GATE_LAST_MOTION[camera_id] = now
+        return True
+    last_motion = MOTION_GATE_LAST_MOTION.get(camera_id)
+    return last_motion is not None and now - last_motion < MOTION_GATE_STICKY_SECONDS
 
-    return detection_made, detection_details
+# Backends capaces de procesar varios frames en una sola inferencia
+BATCH_DETECT_FNS = {
+    "cvlib_yolov4_tiny": detect_objects_cvlib_batch,
+    "pytorch_yolov5": detect_objects_pytorch_batch,
+    "onnx_yolov5n": detect_objects_onnx_batch,
+    "onnx_yolov5n_int8": detect_objects_onnx_batch,
+    "openvino_int8": detect_objects_openvino_batch,
+}
+
+def analyze_frames(frames, camera_ids):
+    """
+    Versión por lotes de analyze_frame para frames de varias cámaras.
+    Si el backend admite lotes se hace un único forward del modelo; si no, se analizan uno a uno.
+    """
+    load_detection_model()
+    batch_fn = BATCH_DETECT_FNS.get(MODEL_TYPE)
+    if batch_fn is None or len(frames) == 1:
+        return [analyze_frame(frame, camera_id) for frame, camera_id in zip(frames, camera_ids)]
+
+    downscaled = [_downscale_frame(frame, camera_id) for frame, camera_id in zip(frames, camera_ids)]
+    results = batch_fn([small for small, _ in downscaled])
+    return [(detection_made, _restore_box_scale(details, scale))
+            for (detection_made, details), (_, scale) in zip(results, downscaled)]
+
+
+class DetectorService(threading.Thread):
+    """
+    Hilo único dueño del modelo: las cámaras envían sus frames con submit() y reciben un Future.
+    Agrupa hasta DETECTION_BATCH_SIZE frames (o espera como máximo DETECTION_BATCH_WAIT segundos)
+    y los analiza juntos con analyze_frames.
+    """
+    def __init__(self, batch_size=DETECTION_BATCH_SIZE, batch_wait=DETECTION_BATCH_WAIT):
+        super().__init__(name="detector-service")
+        self.daemon = True
+        self.requests = queue.Queue()
+        self.batch_size = batch_size
+        # Esperar a completar un lote solo tiene sentido si el backend procesa lotes
+        self.batch_wait = batch_wait if MODEL_TYPE in BATCH_DETECT_FNS else 0.0
+        self.running = False
+
+    def submit(self, frame, camera_id):
+        """Encola un frame para analizar. Devuelve un Future con el resultado de analyze_frame."""
+        future = Future()
+        self.requests.put((frame, camera_id, future))
+        return future
+
+    def _next_batch(self):
+        try:
+            batch = [self.requests.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            try:
+                remaining = deadline - time.monotonic()
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        # Una cámara cancelada (p. ej. al apagar) cancela su Future: no se analiza ni se le asigna resultado
+        return [request for request in batch if request[2].set_running_or_notify_cancel()]
+
+    def run(self):
+        self.running = True
+        load_detection_model()
+        print(f"INFO: Servicio de detección iniciado (lotes de hasta {self.batch_size} frames).")
+        while self.running:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            frames = [frame for frame, _, _ in batch]
+            camera_ids = [camera_id for _, camera_id, _ in batch]
+            try:
+                results = analyze_frames(frames, camera_ids)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+
+        # Cancelar lo que haya quedado pendiente al detener el servicio
+        while True:
+            try:
+                self.requests.get_nowait()[2].cancel()
+            except queue.Empty:
+                break
+        print("INFO: Servicio de detección detenido.")
+
+    def stop(self):
+        self.running = False
+
+
+def _init_detection_worker(num_threads):
+    """Inicializador de cada proceso de ProcessDetectorPool: reparte los núcleos y carga el modelo."""
+    global DETECTION_NUM_THREADS
+    DETECTION_NUM_THREADS = num_threads
+    cv2.setNumThreads(num_threads)
+    load_detection_model()
+
+class ProcessDetectorPool:
+    """
+    Alternativa a DetectorService para backends de CPU, con la misma interfaz (start/submit/stop):
+    cada cámara se asigna siempre al mismo proceso de un solo worker, así su estado (p. ej. el frame
+    anterior del detector de movimiento) vive en un único proceso. El modelo se carga dentro de cada
+    proceso al iniciarlo, nunca en el principal. Los frames se reducen antes de enviarlos al proceso.
+    """
+    def __init__(self, num_cameras, max_workers=None):
+        self.num_workers = max(1, min(num_cameras, max_workers or os.cpu_count() or 1))
+        self.threads_per_worker = max(1, (os.cpu_count() or 1) // self.num_workers)
+        self.pools = []
+        self.camera_pools = {} # camera_id -> ProcessPoolExecutor asignado
+        self.camera_pools_lock = threading.Lock() # submit() se llama desde los hilos de E/S de las cámaras
+
+    def start(self):
+        context = multiprocessing.get_context("spawn") # Sin fork: seguro con hilos ya iniciados en el proceso principal
+        self.pools = [ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_detection_worker,
+                                          initargs=(self.threads_per_worker,))
+                      for _ in range(self.num_workers)]
+        print(f"INFO: Detección en {self.num_workers} procesos ({self.threads_per_worker} hilos cada uno).")
+
+    def submit(self, frame, camera_id):
+        """
+        Envía un frame al proceso de su cámara. Devuelve un Future con el resultado de analyze_frame.
+        Hace trabajo de imagen (reducir el frame), así que no debe llamarse desde el event loop.
+        """
+        with self.camera_pools_lock:
+            pool = self.camera_pools.get(camera_id)
+            if pool is None:
+                pool = self.camera_pools[camera_id] = self.pools[len(self.camera_pools) % len(self.pools)]
+        small, scale = _downscale_frame(frame, camera_id)
+        return pool.submit(_analyze_downscaled, small, camera_id, scale)
+
+    def stop(self):
+        for pool in self.pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+        print("INFO: Procesos de detección detenidos.")
+
+def create_detector_service(num_cameras):
+    """Devuelve el servicio de detección para MODEL_TYPE: procesos (si está activado y el backend es de CPU) o hilo con lotes."""
+    if DETECTION_USE_PROCESSES and MODEL_TYPE in CPU_MODEL_TYPES:
+        return ProcessDetectorPool(num_cameras)
+    return DetectorService()
+
+def _allocate_yolov5_buffers(dynamic_batch):
+    """Reserva los buffers de entrada compartidos de YOLOv5n (ONNX Runtime / OpenVINO)."""
+    global ONNX_DYNAMIC_BATCH, ONNX_RESIZED_BUFFER, ONNX_INPUT_BUFFER
+    ONNX_DYNAMIC_BATCH = dynamic_batch
+    ONNX_RESIZED_BUFFER = np.empty((YOLOV5_INPUT_SIZE[1], YOLOV5_INPUT_SIZE[0], 3), dtype=np.uint8)
+    ONNX_INPUT_BUFFER = np.empty((DETECTION_BATCH_SIZE if dynamic_batch else 1, 3,
+                                  YOLOV5_INPUT_SIZE[1], YOLOV5_INPUT_SIZE[0]), dtype=np.float32)
+
+def load_detection_model():
+    """
+    Carga el modelo de MODEL_TYPE una sola vez, en el proceso que lo va a usar
+    (el servicio de detección o cada proceso de ProcessDetectorPool), no al importar el módulo.
+    """
+    global MODEL_LOADED, DNN_NET, DNN_OUTPUT_LAYERS, ONNX_SESSION, ONNX_INPUT_NAME
+    global OPENVINO_MODEL
+    if MODEL_LOADED:
+        return
+    with MODEL_LOAD_LOCK:
+        if MODEL_LOADED:
+            return
+        if MODEL_TYPE == "cvlib_yolov4_tiny":
+            DNN_NET, DNN_OUTPUT_LAYERS = _load_darknet_model()
+        elif MODEL_TYPE in ONNX_MODEL_PATHS:
+            ONNX_SESSION, ONNX_INPUT_NAME = _load_onnx_session(ONNX_MODEL_PATHS[MODEL_TYPE])
+            if ONNX_SESSION is not None:
+                # Un primer eje no numérico indica que el modelo se exportó con tamaño de lote dinámico
+                _allocate_yolov5_buffers(not isinstance(ONNX_SESSION.get_inputs()[0].shape[0], int))
+        elif MODEL_TYPE == "pytorch_yolov5":
+            # Antes del primer frame: el tamaño de trabajo depende de si se carga TensorRT
+            _initialize_pytorch_model()
+        elif MODEL_TYPE == "openvino_int8":
+            OPENVINO_MODEL = _load_openvino_model()
+            if OPENVINO_MODEL is not None:
+                _allocate_yolov5_buffers(OPENVINO_MODEL.input(0).get_partial_shape()[0].is_dynamic)
+        MODEL_LOADED = True
 
 
 if __name__ == '__main__':
@@ -177,18 +1106,26 @@ if __name__ == '__main__':
         print(f"Intento 2 (con frame previo): Detectado={detected}, Detalles={details}")
 
     elif MODEL_TYPE == "cvlib_yolov4_tiny":
-        print("Probando detección con cvlib (YOLOv4-tiny)...")
-        print("NOTA: Esto puede tardar si es la primera vez (descarga de modelo).")
-        print("      Asegúrese de que cvlib y tensorflow estén instalados.")
+        print("Probando detección con OpenCV DNN (YOLOv4-tiny)...")
+        print(f"NOTA: Se esperan yolov4-tiny.cfg y yolov4-tiny.weights en {YOLO_DARKNET_DIR}.")
         # Para una prueba real, necesitaría una imagen con una persona.
         # Este frame dummy probablemente no detecte nada.
         detected, details = analyze_frame(frame_np, test_camera_id)
-        print(f"cvlib: Detectado={detected}, Detalles={details}")
+        print(f"OpenCV DNN: Detectado={detected}, Detalles={details}")
         if not detected and not details:
              print("INFO: No se detectaron personas. Esto es esperado con un frame de prueba simple.")
              print("      Para una prueba real, use una imagen/video con personas.")
 
 
+    elif MODEL_TYPE in ONNX_MODEL_PATHS or MODEL_TYPE == "openvino_int8":
+        print("Probando detección con ONNX Runtime / OpenVINO (YOLOv5n)...")
+        print(f"NOTA: Se espera el modelo en {ONNX_MODEL_PATHS.get(MODEL_TYPE, OPENVINO_INT8_MODEL_PATH)}.")
+        detected, details = analyze_frame(frame_np, test_camera_id)
+        print(f"YOLOv5n ({MODEL_TYPE}): Detectado={detected}, Detalles={details}")
+        if not detected and not details:
+             print("INFO: No se detectaron personas. Esto es esperado con un frame de prueba simple.")
+             print("      Para una prueba real, use una imagen/video con personas.")
+
     elif MODEL_TYPE == "pytorch_yolov5":
         print("Probando detección con PyTorch (YOLOv5n)...")
         print("NOTA: Esto puede tardar si es la primera vez (descarga de modelo).")
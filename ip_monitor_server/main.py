@@ -1,30 +1,64 @@
 import uvicorn
+import asyncio
 from fastapi import FastAPI
-import json
+from pydantic import BaseModel
+from typing import List, Union
+import orjson
 import os # Para construir rutas de archivo de forma segura
 from contextlib import asynccontextmanager
+from functools import lru_cache
 
-from ip_monitor_server.camera_handler import CameraHandler
+from ip_monitor_server.camera_handler import CameraHandler, create_io_pool
+from ip_monitor_server.detector import create_detector_service
 import ip_monitor_server.alert_queue as alert_queue_module # Importar el módulo
 
 # --- Variables Globales ---
 CONFIG_FILE_PATH = os.path.join(os.path.dirname(__file__), "config.json")
-camera_threads = []
-app_state = {"cameras_loaded": False, "camera_handlers": []}
+app_state = {"cameras_loaded": False, "camera_handlers": [], "camera_tasks": [], "io_pool": None, "detector_service": None}
+
+
+# --- Modelos de respuesta de la API ---
+# Con un response_model FastAPI serializa directamente a JSON con pydantic-core (en Rust),
+# sin pasar por el json estándar ni necesitar una clase de respuesta propia.
+class Alert(BaseModel):
+    timestamp: str # ISO 8601, hora local
+    camera_id: Union[str, int, None]
+    camera_name: Union[str, int, None]
+    details: str
+
+class AlertsResponse(BaseModel):
+    alerts: List[Alert]
+    count: int
+
+class StatusResponse(BaseModel):
+    status: str
+    cameras_configured_and_loaded: bool
+    active_camera_threads: int
+    total_camera_handlers_initialized: int
+    alert_queue_max_size: int
+    current_alerts_in_queue: int
 
 
 # --- Funciones de Configuración ---
+@lru_cache(maxsize=4)
+def _parse_camera_config(config_path, mtime_ns):
+    """
+    Lee y parsea el archivo con orjson (en C). Se cachea por ruta y fecha de modificación, así un
+    archivo editado se vuelve a leer; si el parseo falla la excepción no queda en la caché.
+    """
+    with open(config_path, 'rb') as f:
+        return orjson.loads(f.read())
+
 def load_camera_config(config_path=CONFIG_FILE_PATH):
-    """Carga la configuración de las cámaras desde un archivo JSON."""
-    if not os.path.exists(config_path):
-        print(f"ERROR: El archivo de configuración {config_path} no fue encontrado.")
-        return []
+    """Carga la configuración de las cámaras desde un archivo JSON. La lista devuelta es compartida: no modificarla."""
     try:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
+        config = _parse_camera_config(config_path, os.stat(config_path).st_mtime_ns)
         print(f"INFO: Configuración de cámaras cargada desde {config_path}")
         return config
-    except json.JSONDecodeError:
+    except FileNotFoundError:
+        print(f"ERROR: El archivo de configuración {config_path} no fue encontrado.")
+        return []
+    except orjson.JSONDecodeError:
         print(f"ERROR: El archivo de configuración {config_path} no es un JSON válido.")
         return []
     except Exception as e:
@@ -36,6 +70,7 @@ def load_camera_config(config_path=CONFIG_FILE_PATH):
 async def lifespan(app: FastAPI):
     # Código a ejecutar al inicio (startup)
     print("INFO: Iniciando servidor de monitoreo IP...")
+    alert_queue_module.start_alert_logging()
     cameras_config = load_camera_config()
 
     if not cameras_config:
@@ -44,51 +79,64 @@ async def lifespan(app: FastAPI):
     else:
         print(f"INFO: Se encontraron {len(cameras_config)} cámaras en la configuración.")
         app_state["cameras_loaded"] = True
+        # Un único event loop para todas las cámaras; las lecturas bloqueantes van a un pool compartido
+        app_state["io_pool"] = create_io_pool(len(cameras_config))
+        # El servicio de detección debe estar corriendo antes de que las cámaras envíen frames
+        app_state["detector_service"] = create_detector_service(len(cameras_config))
+        app_state["detector_service"].start()
         for cam_info in cameras_config:
             if not cam_info.get("url"):
                 print(f"WARN: Cámara '{cam_info.get('nombre', 'ID Desconocido')}' no tiene URL. Omitiendo.")
                 continue
 
             # Usar el módulo alert_queue directamente
-            handler = CameraHandler(cam_info, alert_queue_module, processing_interval=1.0) # Procesar cada 1 seg
+            handler = CameraHandler(cam_info, alert_queue_module, app_state["detector_service"],
+                                    processing_interval=1.0, # Procesar cada 1 seg
+                                    io_pool=app_state["io_pool"])
             app_state["camera_handlers"].append(handler)
-            handler.start()
-            print(f"INFO: Hilo para cámara {cam_info.get('nombre', cam_info.get('id'))} iniciado.")
+            app_state["camera_tasks"].append(asyncio.create_task(handler.run_async()))
+            print(f"INFO: Tarea para cámara {cam_info.get('nombre', cam_info.get('id'))} iniciada.")
 
         if not app_state["camera_handlers"]:
-            print("WARN: Ningún hilo de cámara pudo ser iniciado (verifique URLs en config.json).")
+            print("WARN: Ninguna tarea de cámara pudo ser iniciada (verifique URLs en config.json).")
             app_state["cameras_loaded"] = False # Actualizar si ninguna cámara arrancó
 
     yield # El servidor está activo aquí
 
     # Código a ejecutar al apagar (shutdown)
     print("INFO: Deteniendo servidor de monitoreo IP...")
-    for handler in app_state["camera_handlers"]:
-        if handler.is_alive():
-            print(f"INFO: Deteniendo hilo para cámara {handler.camera_name}...")
+    for handler, task in zip(app_state["camera_handlers"], app_state["camera_tasks"]):
+        if not task.done():
+            print(f"INFO: Deteniendo tarea para cámara {handler.camera_name}...")
             handler.stop()
-            # handler.join(timeout=5) # Esperar a que el hilo termine
-            # Quitado el join aquí para un apagado más rápido, los hilos son daemon.
-            # Si se necesita un apagado más grácil donde cada frame actual termine,
-            # se podría re-añadir el join con un timeout.
-    print("INFO: Todos los hilos de cámara han recibido la señal de detención.")
+    print("INFO: Todas las tareas de cámara han recibido la señal de detención.")
+    if app_state["camera_tasks"]:
+        # Cada tarea termina al acabar su lectura en curso; no esperar indefinidamente por streams colgados
+        _, pending = await asyncio.wait(app_state["camera_tasks"], timeout=5)
+        for task in pending: # P. ej. tareas esperando un reintento de conexión
+            task.cancel()
+    if app_state["io_pool"]:
+        app_state["io_pool"].shutdown(wait=False, cancel_futures=True)
+    if app_state["detector_service"]:
+        app_state["detector_service"].stop()
+    alert_queue_module.stop_alert_logging()
 
 app = FastAPI(lifespan=lifespan)
 
 # --- Rutas de la API ---
-@app.get("/")
+@app.get("/", response_model=StatusResponse)
 async def root():
-    num_active_handlers = sum(1 for h in app_state["camera_handlers"] if h.is_alive())
+    num_active_handlers = sum(1 for t in app_state["camera_tasks"] if not t.done())
     return {
         "status": "IP Monitor Server running",
         "cameras_configured_and_loaded": app_state["cameras_loaded"],
         "active_camera_threads": num_active_handlers,
         "total_camera_handlers_initialized": len(app_state["camera_handlers"]),
         "alert_queue_max_size": alert_queue_module.MAX_ALERTS_IN_MEMORY,
-        "current_alerts_in_queue": len(alert_queue_module.recent_alerts)
+        "current_alerts_in_queue": alert_queue_module.get_alert_count()
     }
 
-@app.get("/api/alertas")
+@app.get("/api/alertas", response_model=AlertsResponse)
 async def get_alerts(limit: int = 20):
     """
     Devuelve las 'limit' alertas más recientes.
@@ -100,7 +148,7 @@ async def get_alerts(limit: int = 20):
     alerts = alert_queue_module.get_all_alerts_sorted(limit=limit)
     return {"alerts": alerts, "count": len(alerts)}
 
-@app.get("/api/alertas/all")
+@app.get("/api/alertas/all", response_model=AlertsResponse)
 async def get_all_alerts_in_memory():
     """
     Devuelve todas las alertas actualmente en la memoria de la cola (hasta MAX_ALERTS_IN_MEMORY).
@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+import cv2
+import numpy as np
+
+from ip_monitor_server.detector import (MODELS_DIR, ONNX_FP32_MODEL_PATH, ONNX_INT8_MODEL_PATH, OPENVINO_INT8_MODEL_PATH,
+                                        PERSON_CLASS_ID, YOLOV5_INPUT_SIZE, export_yolov5n_onnx, preprocess_yolov5)
+from ip_monitor_server.main import load_camera_config
+
+# Herramienta (fuera de línea) para generar los modelos YOLOv5n de ONNX Runtime: el FP32 exportado
+# (MODEL_TYPE="onnx_yolov5n") y su versión cuantizada a INT8 (MODEL_TYPE="onnx_yolov5n_int8").
+# Si openvino está instalado, el modelo INT8 también se convierte a IR (MODEL_TYPE="openvino_int8").
+# Uso (desde la raíz del proyecto):
+#   python -m ip_monitor_server.quantize_model
+# Requiere: torch, onnx y onnxruntime (solo para generar el modelo, no para ejecutarlo).
+
+CALIBRATION_FRAMES = 100 # Frames usados para calibrar los rangos de activación
+CALIBRATION_FRAME_STEP = 15 # Tomar 1 de cada N frames para que la muestra sea variada
+# Solo se cuantizan las capas con pesos. La cabeza Detect (model.24) queda en float: su Concat final mezcla
+# xywh en píxeles (0..640) con puntuaciones 0..1, y un único rango uint8 dejaría las confianzas en 0 o ~2.5.
+QUANTIZE_OP_TYPES = ["Conv", "MatMul"]
+DETECT_HEAD_NODE_PREFIX = "/model.24/"
+VERIFICATION_FRAMES = 10 # Frames de calibración con los que se compara el modelo INT8 con el FP32
+MAX_INT8_SCORE_ERROR = 0.15 # Diferencia máxima de objectness / confianza de persona para aceptar el modelo INT8
+
+
+def collect_calibration_frames(cameras_config, max_frames=CALIBRATION_FRAMES):
+    """Lee frames de las cámaras configuradas para calibrar la cuantización."""
+    frames = []
+    per_camera = max(1, max_frames // max(1, len(cameras_config)))
+    for cam_info in cameras_config:
+        url = cam_info.get("url")
+        if not url:
+            continue
+        cap = cv2.VideoCapture(url)
+        if not cap.isOpened():
+            print(f"WARN: No se pudo abrir {cam_info.get('nombre', url)} para calibración. Omitiendo.")
+            continue
+        taken, read = 0, 0
+        while taken < per_camera:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if read % CALIBRATION_FRAME_STEP == 0:
+                frames.append(frame)
+                taken += 1
+            read += 1
+        cap.release()
+        print(f"INFO: {taken} frames de calibración tomados de {cam_info.get('nombre', url)}.")
+    return frames
+
+
+def _yolov5_blob(frame):
+    """Frame como entrada (1, 3, H, W) de YOLOv5n."""
+    resized = np.empty((YOLOV5_INPUT_SIZE[1], YOLOV5_INPUT_SIZE[0], 3), dtype=np.uint8)
+    blob = np.empty((1, 3, YOLOV5_INPUT_SIZE[1], YOLOV5_INPUT_SIZE[0]), dtype=np.float32)
+    preprocess_yolov5(frame, resized, blob[0])
+    return blob
+
+def _yolov5_scores(model_path, frames):
+    """Objectness y confianza de persona de cada predicción del modelo, para todos los frames."""
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+    scores = []
+    for frame in frames:
+        predictions = session.run(None, {input_name: _yolov5_blob(frame)})[0][0]
+        scores.append(np.stack([predictions[:, 4], predictions[:, 4] * predictions[:, 5 + PERSON_CLASS_ID]]))
+    return np.stack(scores)
+
+def verify_int8_model(fp32_path, int8_path, frames):
+    """Compara las salidas del modelo INT8 con las del FP32. Devuelve True si la diferencia es aceptable."""
+    error = float(np.abs(_yolov5_scores(int8_path, frames) - _yolov5_scores(fp32_path, frames)).max())
+    print(f"INFO: Diferencia máxima INT8 vs FP32 (objectness / confianza de persona): {error:.3f}")
+    return error <= MAX_INT8_SCORE_ERROR
+
+def quantize_yolov5n_int8(fp32_path, int8_path, frames):
+    """
+    Cuantiza estáticamente el modelo ONNX a INT8 (QDQ) calibrando con los frames dados.
+    El modelo solo se guarda en 'int8_path' si sus salidas coinciden con las del FP32; si no, devuelve None.
+    """
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class FrameCalibrationReader(CalibrationDataReader):
+        def __init__(self, input_name, calibration_frames):
+            self.input_name = input_name
+            self.frames = iter(calibration_frames)
+
+        def get_next(self):
+            frame = next(self.frames, None)
+            if frame is None:
+                return None
+            return {self.input_name: _yolov5_blob(frame)}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Inferencia de formas y fusión de capas antes de cuantizar, como recomienda ONNX Runtime
+        preprocessed_path = os.path.join(work_dir, "yolov5n_preprocessed.onnx")
+        quant_pre_process(fp32_path, preprocessed_path)
+        head_nodes = [node.name for node in onnx.load(preprocessed_path).graph.node
+                      if node.name.startswith(DETECT_HEAD_NODE_PREFIX)]
+
+        candidate_path = os.path.join(work_dir, "yolov5n_int8.onnx")
+        quantize_static(preprocessed_path, candidate_path, FrameCalibrationReader("images", frames),
+                        quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        op_types_to_quantize=QUANTIZE_OP_TYPES, nodes_to_exclude=head_nodes)
+        if not verify_int8_model(fp32_path, candidate_path, frames[:VERIFICATION_FRAMES]):
+            print(f"ERROR: El modelo INT8 difiere demasiado del FP32 (más de {MAX_INT8_SCORE_ERROR}). No se guarda.")
+            return None
+        shutil.move(candidate_path, int8_path) # El directorio temporal puede estar en otro sistema de archivos
+    print(f"INFO: Modelo INT8 guardado en {int8_path}")
+    return int8_path
+
+
+def convert_to_openvino_ir(onnx_path, xml_path):
+    """Convierte el modelo ONNX (QDQ) a IR de OpenVINO; las capas cuantizadas se ejecutan en INT8."""
+    import openvino as ov
+
+    # Sin compresión a FP16: los pesos ya están cuantizados y el resto debe quedar como en el ONNX
+    ov.save_model(ov.convert_model(onnx_path), xml_path, compress_to_fp16=False)
+    print(f"INFO: Modelo IR de OpenVINO guardado en {xml_path}")
+    return xml_path
+
+
+if __name__ == "__main__":
+    os.makedirs(MODELS_DIR, exist_ok=True)
+
+    if not os.path.exists(ONNX_FP32_MODEL_PATH):
+        export_yolov5n_onnx(ONNX_FP32_MODEL_PATH)
+
+    calibration_frames = collect_calibration_frames(load_camera_config())
+    if not calibration_frames:
+        print("ERROR: No se obtuvieron frames de calibración (verifique las cámaras en config.json).")
+    elif quantize_yolov5n_int8(ONNX_FP32_MODEL_PATH, ONNX_INT8_MODEL_PATH, calibration_frames) is None:
+        print("ERROR: No se genera el modelo para MODEL_TYPE='openvino_int8' (el INT8 no pasó la comparación con FP32).")
+    else:
+        # El IR se genera siempre a partir del INT8 recién verificado (cabeza Detect en float)
+        try:
+            convert_to_openvino_ir(ONNX_INT8_MODEL_PATH, OPENVINO_INT8_MODEL_PATH)
+        except ImportError:
+            print("INFO: openvino no está instalado; no se genera el modelo para MODEL_TYPE='openvino_int8'.")